@@ -0,0 +1,207 @@
+import hashlib
+import inspect
+import math
+import random
+import time
+from collections import namedtuple
+from functools import wraps
+
+from django.core.cache import cache
+
+# Шаблон ключа кэша с номером поколения тега (post:1, feed:index...)
+GENERATION_KEY: str = 'generation:{}'
+
+# Шаблон ключа кэша результата функции
+CACHED_KEY: str = 'cached:{}:{}'
+
+# Шаблон ключа блокировки пересчёта записи
+LOCK_KEY: str = 'lock:{}'
+
+# Через сколько секунд блокировка снимается сама, если
+# пересчитывавший worker упал
+LOCK_TIMEOUT: int = 10
+
+# Сколько секунд после истечения запись ещё хранится, чтобы
+# отдавать её, пока другой worker считает новую
+STALE_TIMEOUT: int = 60
+
+# Чем больше, тем раньше до истечения начинается пересчёт
+EARLY_REFRESH_BETA: float = 1.0
+
+# Значение с поколениями тегов на момент расчёта,
+# временем расчёта в секундах и сроком годности
+Entry = namedtuple('Entry', 'value tags delta expires')
+
+
+def new_generation():
+    """
+    Начальный номер поколения. Берётся от текущего времени,
+    чтобы вытесненный из кэша счётчик не начинался заново
+    и не совпал со старыми ключами.
+    """
+    return int(time.time() * 1000)
+
+
+def get_generations(*tags):
+    """Текущие номера поколений тегов в порядке tags."""
+    keys = [GENERATION_KEY.format(tag) for tag in tags]
+    found = cache.get_many(keys)
+    missing = {key: new_generation() for key in keys if key not in found}
+    for key, value in missing.items():
+        cache.add(key, value, None)
+    if missing:
+        found.update(cache.get_many(list(missing)))
+    return [found.get(key, missing.get(key)) for key in keys]
+
+
+def generation_key(*tags):
+    """Строка из номеров поколений для ключа кэша."""
+    return '.'.join(str(value) for value in get_generations(*tags))
+
+
+def invalidate_tags(*tags):
+    """
+    Сдвигает поколения тегов: всё закэшированное с любым
+    из них устаревает во всех worker-ах.
+    """
+    for tag in tags:
+        key = GENERATION_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, new_generation(), None)
+
+
+def tag_request(request, *tags):
+    """
+    Помечает страницу тегами для кэша страниц. Поколения
+    запоминаются до чтения данных, поэтому изменение во время
+    отрисовки не попадёт в кэш под новым поколением.
+    """
+    request.cache_tags = {
+        **getattr(request, 'cache_tags', {}),
+        **dict(zip(tags, get_generations(*tags))),
+    }
+
+
+def get_entry(key):
+    """Запись кэша; значения в другом формате считаются промахом."""
+    entry = cache.get(key)
+    return entry if isinstance(entry, Entry) else None
+
+
+def is_current(entry):
+    """
+    Поколения тегов записи не сдвинулись. Запись со сдвинутыми
+    поколениями не отдаётся даже на время пересчёта: после
+    правки или удаления старые данные не показываются.
+    """
+    tags = entry.tags
+    return get_generations(*tags) == list(tags.values())
+
+
+def is_fresh(entry, beta=EARLY_REFRESH_BETA):
+    """
+    Запись свежая, если не истёк срок и не выпал ранний
+    пересчёт. Вероятность пересчёта растёт к концу срока
+    и тем выше, чем дольше запись считается, поэтому горячую
+    запись обычно обновляет один запрос до того, как она
+    истечёт у всех сразу.
+    """
+    if entry.expires is None:
+        return True
+    jitter = entry.delta * beta * math.log(1 - random.random())
+    return time.time() - jitter < entry.expires
+
+
+def acquire_lock(key):
+    """Берёт блокировку пересчёта; False, если её держит другой."""
+    return cache.add(LOCK_KEY.format(key), True, LOCK_TIMEOUT)
+
+
+def release_lock(key):
+    # Нулевой срок снимает блокировку: следующий add её займёт
+    cache.touch(LOCK_KEY.format(key), 0)
+
+
+def store_entry(key, value, tags, delta, timeout):
+    """Сохраняет значение с запасом STALE_TIMEOUT на устаревание."""
+    expires = None if timeout is None else time.time() + timeout
+    cache.set(
+        key,
+        Entry(value, tags, delta, expires),
+        None if timeout is None else timeout + STALE_TIMEOUT
+    )
+
+
+def get_or_refresh(key, compute, timeout, tags=()):
+    """
+    Значение из кэша или результат compute(). Истёкшую по
+    времени запись пересчитывает один worker, остальные в это
+    время отдают старое значение. Запись со сдвинутыми
+    поколениями тегов пересчитывается сразу.
+    """
+    entry = get_entry(key)
+    locked = False
+    if entry is not None and is_current(entry):
+        if is_fresh(entry) or not acquire_lock(key):
+            return entry.value
+        locked = True
+    # Поколения запоминаются до расчёта, как в tag_request
+    tags = dict(zip(tags, get_generations(*tags)))
+    try:
+        start = time.monotonic()
+        value = compute()
+        store_entry(key, value, tags, time.monotonic() - start, timeout)
+    finally:
+        if locked:
+            release_lock(key)
+    return value
+
+
+def key_part(value):
+    """Объекты моделей входят в ключ кэша своим pk."""
+    return getattr(value, 'pk', value)
+
+
+def cached(timeout, *tags):
+    """
+    Кэширует результат функции до сдвига поколения тегов.
+    Теги — шаблоны с именами аргументов: 'post:{post.pk}'.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            arguments = arguments.arguments
+            raw = repr([
+                (argument, key_part(value))
+                for argument, value in arguments.items()
+            ])
+            digest = hashlib.md5(raw.encode()).hexdigest()
+            return get_or_refresh(
+                CACHED_KEY.format(name, digest),
+                lambda: func(*args, **kwargs),
+                timeout,
+                [tag.format(**arguments) for tag in tags]
+            )
+        return wrapper
+    return decorator
+
+
+def cache_tags(*tags):
+    """
+    Помечает страницу тегами из аргументов view для кэша
+    страниц: @cache_tags('feed:index'), @cache_tags('post:{post_id}').
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            tag_request(request, *(tag.format(**kwargs) for tag in tags))
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as PoolTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps, ImageSequence
+
+# Что остаётся от метаданных картинки после перекодирования
+KEEP_INFO: tuple = ('transparency',)
+
+# Расширения и типы файлов после перекодирования
+FORMATS: dict = {
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'PNG': ('.png', 'image/png'),
+    'GIF': ('.gif', 'image/gif'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+
+# Форматы с анимацией; анимация перекодируется в тот же формат
+ANIMATED_FORMATS: tuple = ('GIF', 'PNG', 'WEBP')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class TooManyFrames(ValueError):
+    """Во всех кадрах анимации вместе больше IMAGE_MAX_PIXELS."""
+
+    def __init__(self, frames):
+        super().__init__(frames)
+        self.frames = frames
+
+
+class IngestedImage(TemporaryUploadedFile):
+    """
+    Перекодированная картинка во временном файле. Хранилище
+    переносит файл на место, поэтому закрывается он здесь же:
+    close() уже не находит файл и не сообщает об этом.
+    """
+
+    def __del__(self):
+        self.close()
+
+
+def get_executor():
+    """
+    Пул процессов; создаётся при первой загрузке. Процессы
+    запускаются через spawn, чтобы не копировать потоки
+    и соединения с базой родителя.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def reset_executor(executor):
+    """
+    Убирает сломанный или занятый зависшей задачей пул:
+    следующая загрузка создаст новый. Процессы старого пула
+    завершаются, чтобы зависшая задача не занимала процессор.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    # У ProcessPoolExecutor нет способа прервать запущенную
+    # задачу, поэтому процессы завершаются напрямую. Задачи
+    # из очереди старого пула получат BrokenProcessPool
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False)
+    for process in processes:
+        process.terminate()
+
+
+def validate_image(upload):
+    """
+    Отклоняет слишком большие файлы и картинки с огромным
+    числом пикселей. Размеры берутся из заголовка, который
+    уже прочитан ImageField: пиксели не распаковываются.
+    """
+    if upload.size > settings.IMAGE_MAX_SIZE:
+        raise forms.ValidationError(
+            'Файл больше %(limit)s МБ.',
+            params={'limit': settings.IMAGE_MAX_SIZE // (1024 * 1024)},
+            code='file_too_large'
+        )
+    width, height = upload.image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise forms.ValidationError(
+            'Слишком большая картинка: %(width)s×%(height)s.',
+            params={'width': width, 'height': height},
+            code='too_many_pixels'
+        )
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def normalize_animation(image, target, max_dimension, quality):
+    """
+    Перекодирует анимацию покадрово в её же формат: каждый
+    кадр уменьшается до max_dimension, метаданные не
+    переносятся, кроме длительности кадров и числа повторов.
+    """
+    format_ = image.format if image.format in ANIMATED_FORMATS else 'GIF'
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', 0))
+        frame = frame.convert('RGBA')
+        frame.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        # GIF берёт комментарий и прочее из info кадра
+        frame.info = {}
+        frames.append(frame)
+    options = {'loop': image.info['loop']} if 'loop' in image.info else {}
+    if format_ == 'GIF':
+        # Прозрачные места кадра не показывают предыдущий кадр
+        options['disposal'] = 2
+    frames[0].save(
+        target,
+        format_,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        quality=quality,
+        **options
+    )
+    return format_
+
+
+def normalize(source, target, max_dimension, quality, max_pixels):
+    """
+    Задача процесса: поворачивает картинку по EXIF, уменьшает
+    до max_dimension по большей стороне и сохраняет в target
+    без метаданных. Возвращает формат. Анимация с числом
+    пикселей во всех кадрах больше max_pixels не принимается.
+    """
+    with Image.open(source) as image:
+        if getattr(image, 'is_animated', False):
+            width, height = image.size
+            if image.n_frames * width * height > max_pixels:
+                raise TooManyFrames(image.n_frames)
+            return normalize_animation(
+                image, target, max_dimension, quality
+            )
+        # JPEG сразу распаковывается в уменьшенном масштабе
+        image.draft(None, (max_dimension, max_dimension))
+        icc_profile = image.info.get('icc_profile')
+        alpha = has_alpha(image)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        image.info = {
+            key: value for key, value in image.info.items()
+            if key in KEEP_INFO
+        }
+        options = {'icc_profile': icc_profile} if icc_profile else {}
+        if alpha:
+            image.save(target, 'PNG', optimize=True, **options)
+            return 'PNG'
+        image.convert('RGB').save(
+            target,
+            'JPEG',
+            quality=quality,
+            optimize=True,
+            progressive=True,
+            **options
+        )
+        return 'JPEG'
+
+
+def source_path(upload, stack):
+    """
+    Путь к загруженному файлу на диске. Загрузка из памяти
+    сначала пишется во временный файл по частям.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        return upload.temporary_file_path()
+    copy = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.upload'))
+    for chunk in upload.chunks():
+        copy.write(chunk)
+    copy.flush()
+    return copy.name
+
+
+def run(*args):
+    """
+    Выполняет normalize в пуле процессов; с IMAGE_WORKERS = 0 —
+    сразу. Пул, процесс которого упал или не уложился
+    в IMAGE_TIMEOUT, заменяется новым.
+    """
+    if not settings.IMAGE_WORKERS:
+        return normalize(*args)
+    executor = get_executor()
+    try:
+        future = executor.submit(normalize, *args)
+        return future.result(timeout=settings.IMAGE_TIMEOUT)
+    except (BrokenProcessPool, PoolTimeoutError):
+        reset_executor(executor)
+        raise
+
+
+def ingest(upload):
+    """
+    Перекодированная копия загруженной картинки для ImageField:
+    без EXIF, не больше IMAGE_MAX_DIMENSION, JPEG прогрессивный,
+    анимация — покадрово.
+    Результат — временный файл, который хранилище переносит
+    на место без копирования.
+    """
+    result = IngestedImage(upload.name, upload.content_type, 0, None)
+    with ExitStack() as stack:
+        try:
+            format_ = run(
+                source_path(upload, stack),
+                result.temporary_file_path(),
+                settings.IMAGE_MAX_DIMENSION,
+                settings.IMAGE_QUALITY,
+                settings.IMAGE_MAX_PIXELS
+            )
+        except TooManyFrames as error:
+            result.close()
+            raise forms.ValidationError(
+                'Слишком много кадров: %(frames)s.',
+                params={'frames': error.frames},
+                code='too_many_pixels'
+            )
+        except (OSError, ValueError, Image.DecompressionBombError,
+                BrokenProcessPool, PoolTimeoutError):
+            result.close()
+            raise forms.ValidationError(
+                'Не удалось обработать картинку.', code='invalid_image'
+            )
+    extension, content_type = FORMATS[format_]
+    result.name = os.path.splitext(upload.name)[0] + extension
+    result.content_type = content_type
+    result.file.seek(0, os.SEEK_END)
+    result.size = result.file.tell()
+    result.file.seek(0)
+    return result
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.sqlite_cache import SQLiteCache
+
+# Сколько операций каждого вида выполнять по умолчанию
+OPERATIONS: int = 2000
+
+# Лимит записей LocMem и файлового кэша, чтобы они
+# не вытесняли ключи во время замера
+MAX_ENTRIES: int = 10 ** 6
+
+# Сравниваемые бэкенды
+BACKENDS: tuple = ('locmem', 'filebased', 'sqlite')
+
+# Значение, похожее на закэшированный фрагмент ленты
+PAYLOAD: str = '<article>' + 'x' * 2000 + '</article>'
+
+
+def make_backend(name, directory):
+    """Сравниваемый бэкенд с хранилищем во временной папке."""
+    params = {'OPTIONS': {'MAX_ENTRIES': MAX_ENTRIES}}
+    if name == 'locmem':
+        return LocMemCache(directory, params)
+    if name == 'filebased':
+        return FileBasedCache(os.path.join(directory, 'files'), params)
+    return SQLiteCache(os.path.join(directory, 'cache.sqlite3'), params)
+
+
+def run_operations(name, directory, operations, prefix='key'):
+    """Замеряет set/get/incr одного бэкенда, возвращает op/s."""
+    cache = make_backend(name, directory)
+    results = {}
+    for operation, call in (
+        ('set', lambda i: cache.set(f'{prefix}:{i}', PAYLOAD)),
+        ('get', lambda i: cache.get(f'{prefix}:{i}')),
+        ('incr', lambda i: cache.incr(f'{prefix}:counter')),
+    ):
+        cache.set(f'{prefix}:counter', 0)
+        started = time.perf_counter()
+        for i in range(operations):
+            call(i)
+        results[operation] = operations / (time.perf_counter() - started)
+    return results
+
+
+def shared_hits(name, directory, operations):
+    """
+    Доля ключей, записанных другим процессом и видимых
+    в этом: показывает, общий ли кэш у worker-ов.
+    """
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(
+            run_operations, name, directory, operations, 'shared'
+        ).result()
+    cache = make_backend(name, directory)
+    found = cache.get_many([f'shared:{i}' for i in range(operations)])
+    return len(found) / operations
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость LocMem, файлового и SQLite кэша.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations',
+            type=int,
+            default=OPERATIONS,
+            help='Сколько операций каждого вида выполнить'
+        )
+
+    def handle(self, *args, **options):
+        operations = options['operations']
+        for name in BACKENDS:
+            with tempfile.TemporaryDirectory() as directory:
+                result = run_operations(name, directory, operations)
+                shared = shared_hits(name, directory, operations)
+            self.stdout.write(
+                f'{name:>10}: '
+                + ', '.join(
+                    f'{operation} {rate:,.0f} op/s'
+                    for operation, rate in result.items()
+                )
+                + f', общие ключи между процессами {shared:.0%}'
+            )
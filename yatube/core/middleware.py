@@ -0,0 +1,93 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .cache import (acquire_lock, get_entry, is_current, is_fresh,
+                    release_lock, store_entry)
+
+# Шаблон ключа кэша страницы
+PAGE_CACHE_KEY: str = 'page:{}'
+
+
+def page_cache_key(request):
+    """Ключ кэша страницы по адресу и строке запроса."""
+    url = request.build_absolute_uri().encode()
+    return PAGE_CACHE_KEY.format(hashlib.md5(url).hexdigest())
+
+
+def is_cacheable_request(request):
+    """Кэшируются только GET-запросы анонимных читателей."""
+    return (
+        not settings.DEBUG
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+    )
+
+
+def is_cacheable_response(request, response):
+    """
+    Страница кэшируется, если view пометила её тегами,
+    ответ успешный, без cookie и без CSRF-токена.
+    """
+    return (
+        getattr(request, 'cache_tags', None)
+        and response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Кэш целых страниц для анонимных читателей. Страница
+    устаревает, как только сдвигается поколение любого из
+    тегов, которыми её пометила view (post:1, author:1...).
+    Истёкшую по времени страницу перерисовывает один запрос,
+    остальные пока получают старую; страница со сдвинутыми
+    поколениями перерисовывается сразу.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_cacheable_request(request):
+            return self.get_response(request)
+        key = page_cache_key(request)
+        entry = get_entry(key)
+        locked = False
+        if entry is not None and is_current(entry):
+            if is_fresh(entry) or not acquire_lock(key):
+                return self.cached_response(request, entry.value)
+            locked = True
+        try:
+            start = time.monotonic()
+            response = self.get_response(request)
+            if is_cacheable_response(request, response):
+                store_entry(
+                    key,
+                    response,
+                    request.cache_tags,
+                    time.monotonic() - start,
+                    settings.PAGE_CACHE_TIMEOUT
+                )
+        finally:
+            if locked:
+                release_lock(key)
+        return response
+
+    @staticmethod
+    def cached_response(request, response):
+        last_modified = response.get('Last-Modified')
+        return get_conditional_response(
+            request,
+            etag=response.get('ETag'),
+            last_modified=last_modified and parse_http_date_safe(
+                last_modified
+            ),
+            response=response
+        )
@@ -0,0 +1,15 @@
+from django.db import models
+
+
+class StoredFile(models.Model):
+    """Сколько записей ссылается на файл в ContentAddressedStorage."""
+
+    name = models.CharField('Имя файла', max_length=255, unique=True)
+    references = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,256 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Сколько байт значений хранить по умолчанию
+MAX_SIZE: int = 64 * 1024 * 1024
+
+# Раз в сколько записей проверять размер кэша
+CULL_EVERY: int = 100
+
+# Сколько миллисекунд ждать освобождения блокировки базы
+BUSY_TIMEOUT: int = 5000
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL,'
+    ' stored REAL NOT NULL,'
+    ' size INTEGER NOT NULL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE INDEX IF NOT EXISTS cache_stored ON cache (stored)',
+)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кэш в файле SQLite в режиме WAL. Один файл читают
+    и пишут все процессы на хосте, поэтому сброс кэша в одном
+    worker виден остальным. incr атомарен между процессами,
+    при превышении MAX_SIZE вытесняются самые старые записи.
+
+    LOCATION — путь к файлу базы, OPTIONS: MAX_SIZE, CULL_EVERY.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        options = params.get('OPTIONS', {})
+        self.max_size = int(options.get('MAX_SIZE', MAX_SIZE))
+        self.cull_every = int(options.get('CULL_EVERY', CULL_EVERY))
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def connection(self):
+        """Отдельное соединение на каждый поток и процесс."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path,
+                timeout=BUSY_TIMEOUT / 1000,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _write(self, sql, params, cull=True):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute(sql, params)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        if cull:
+            self._maybe_cull()
+        return cursor.rowcount
+
+    def _store(self, key, value, timeout, version, mode):
+        key = self._key(key, version)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        if mode == 'add':
+            # Просроченную запись можно занять заново
+            self._write(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, now),
+                cull=False
+            )
+            sql = 'INSERT OR IGNORE'
+        else:
+            sql = 'INSERT OR REPLACE'
+        return self._write(
+            f'{sql} INTO cache (key, value, expires, stored, size) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, blob, expires, now, len(blob))
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self._store(key, value, timeout, version, 'add'))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version, 'set')
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout, version)
+        return []
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self.connection.execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        return {
+            key: value
+            for key, (value, _) in self.get_many_expiring(
+                keys, version
+            ).items()
+        }
+
+    def get_many_expiring(self, keys, version=None):
+        """
+        Пары (значение, срок) для найденных ключей; срок —
+        время истечения в секундах эпохи или None для вечных.
+        По сроку L1 в TwoTierCache не переживает запись.
+        """
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        placeholders = ', '.join('?' * len(keys))
+        rows = self.connection.execute(
+            f'SELECT key, value, expires FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            'AND (expires IS NULL OR expires > ?)',
+            (*keys, time.time())
+        ).fetchall()
+        return {
+            keys[key]: (pickle.loads(value), expires)
+            for key, value, expires in rows
+        }
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return bool(self._write(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+            cull=False
+        ))
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._write('DELETE FROM cache WHERE key = ?', (key,), cull=False)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            placeholders = ', '.join('?' * len(keys))
+            self._write(
+                f'DELETE FROM cache WHERE key IN ({placeholders})',
+                keys,
+                cull=False
+            )
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self.connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def incr(self, key, delta=1, version=None):
+        """Чтение и запись под одной блокировкой записи SQLite."""
+        key = self._key(key, version)
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute(
+                'UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                (blob, len(blob), key)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return value
+
+    def clear(self):
+        self._write('DELETE FROM cache', (), cull=False)
+
+    def _maybe_cull(self):
+        self._writes += 1
+        if self._writes % self.cull_every == 0:
+            self.cull()
+
+    def cull(self):
+        """Удаляет просроченные записи и самые старые сверх MAX_SIZE."""
+        self._write(
+            'DELETE FROM cache WHERE expires <= ?',
+            (time.time(),),
+            cull=False
+        )
+        total = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM cache'
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Удаляем с запасом в четверть лимита, чтобы не
+        # вытеснять по одной записи на каждую запись
+        self._write(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM ('
+            '  SELECT key, SUM(size) OVER (ORDER BY stored, key) AS running'
+            '  FROM cache'
+            ' ) WHERE running <= ?'
+            ')',
+            (total - self.max_size * 3 // 4,),
+            cull=False
+        )
+
+    def close(self, **kwargs):
+        # Соединение живёт всё время процесса: открывать
+        # базу заново на каждый запрос дороже, чем держать её
+        pass
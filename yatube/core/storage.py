@@ -0,0 +1,98 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredFile
+
+# Сколько уровней каталогов по два символа хеша: при двух
+# уровнях 65536 каталогов, и в каждом немного файлов даже
+# при миллионах картинок
+SHARD_LEVELS: int = 2
+
+
+def content_hash(content):
+    """SHA-256 содержимого; файл читается по частям."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """posts/photo.jpg -> posts/ab/cd/abcd…ef.jpg"""
+    directory, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    shards = [digest[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)]
+    return os.path.join(directory, *shards, digest + extension)
+
+
+def acquire(name):
+    """
+    Добавляет ссылку на файл. Транзакция начинается с записи:
+    SQLite сразу ждёт блокировку, а не падает с «database is
+    locked» при повышении блокировки с чтения до записи.
+    """
+    if StoredFile.objects.filter(name=name).update(
+        references=F('references') + 1
+    ):
+        return
+    try:
+        with transaction.atomic():
+            StoredFile.objects.create(name=name, references=1)
+    except IntegrityError:
+        # Счётчик одновременно создала другая загрузка
+        StoredFile.objects.filter(name=name).update(
+            references=F('references') + 1
+        )
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище с именами по хешу содержимого. Одинаковые
+    загрузки хранятся одним файлом, а StoredFile считает
+    ссылки на него: delete() убирает ссылку и удаляет файл,
+    только когда ссылок не осталось.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Имя по хешу выбирается в _save, и файл с тем же
+        # именем — тот же файл, а не конфликт
+        return name
+
+    def _save(self, name, content):
+        name = hashed_name(name, content_hash(content))
+        with transaction.atomic():
+            # Ссылка берётся до проверки файла: delete() того же
+            # имени ждёт конца транзакции и файл не удалит
+            acquire(name)
+            if not self.exists(name):
+                self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        """
+        Пишет файл под временным именем рядом и переносит на
+        место: параллельная загрузка того же содержимого просто
+        заменит файл таким же.
+        """
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        os.replace(self.path(temporary), self.path(name))
+
+    def delete(self, name):
+        """
+        Снимает ссылку на файл. Файлы без счётчика (загруженные
+        до этого хранилища) не удаляются.
+        """
+        with transaction.atomic():
+            if not StoredFile.objects.filter(name=name).update(
+                references=F('references') - 1
+            ):
+                return
+            if StoredFile.objects.filter(name=name, references=0).delete()[0]:
+                super().delete(name)
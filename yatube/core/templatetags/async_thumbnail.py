@@ -0,0 +1,21 @@
+from django import template
+
+from core.thumbnails import ready_thumbnail, schedule_thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def async_thumbnail(file_, geometry, **options):
+    """
+    {% async_thumbnail post.image "960x339" crop="center" as im %}
+
+    Готовая миниатюра или None. Недостающая миниатюра ставится
+    в очередь, а страница рисуется сразу, без ожидания Pillow.
+    """
+    if not file_:
+        return None
+    thumbnail = ready_thumbnail(file_, geometry, **options)
+    if thumbnail is None:
+        schedule_thumbnails(file_, [(geometry, options)])
+    return thumbnail
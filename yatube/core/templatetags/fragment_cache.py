@@ -0,0 +1,54 @@
+from django import template
+
+from core.cache import get_or_refresh
+
+register = template.Library()
+
+# Шаблон ключа кэша фрагмента шаблона
+FRAGMENT_KEY: str = 'fragment:{}'
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, key, tags):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.key = key
+        self.tags = tags
+
+    def resolve_tags(self, context):
+        """Тег в шаблоне может быть строкой или списком строк."""
+        tags = []
+        for tag in self.tags:
+            value = tag.resolve(context)
+            if isinstance(value, (list, tuple, set)):
+                tags.extend(value)
+            else:
+                tags.append(value)
+        return tags
+
+    def render(self, context):
+        return get_or_refresh(
+            FRAGMENT_KEY.format(self.key.resolve(context)),
+            lambda: self.nodelist.render(context),
+            self.timeout.resolve(context),
+            self.resolve_tags(context)
+        )
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """
+    {% fragment_cache timeout key tag... %} ... {% endfragment_cache %}
+
+    Кэширует фрагмент до сдвига поколения любого из тегов.
+    Истекающий фрагмент перерисовывает один запрос.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает срок, ключ и теги кэша"
+        )
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    timeout, key, *tags = (parser.compile_filter(bit) for bit in bits[1:])
+    return FragmentCacheNode(nodelist, timeout, key, tags)
@@ -0,0 +1,20 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def variants(thumbnails, format_):
+    """Миниатюры одного формата: {{ thumbnails|variants:"WEBP" }}."""
+    return [
+        thumbnail for thumbnail in thumbnails or ()
+        if thumbnail.format == format_
+    ]
+
+
+@register.filter
+def srcset(thumbnails):
+    """Значение атрибута srcset: адрес и ширина каждой миниатюры."""
+    return ', '.join(
+        f'{thumbnail.url} {thumbnail.width}w' for thumbnail in thumbnails
+    )
@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты с настройками из yatube/settings_test.py."""
+
+    def setup_test_environment(self, **kwargs):
+        from yatube.settings_test import OVERRIDES
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(**OVERRIDES)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
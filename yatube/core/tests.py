@@ -0,0 +1,381 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from . import tiered_cache
+from .cache import (Entry, acquire_lock, cache_tags, cached, get_generations,
+                    get_or_refresh, invalidate_tags, is_fresh, store_entry)
+from .models import StoredFile
+from .sqlite_cache import SQLiteCache
+from .storage import ContentAddressedStorage
+from .tiered_cache import TwoTierCache
+
+
+def increment(path, times):
+    """Увеличивает счётчик из отдельного процесса."""
+    cache = SQLiteCache(path, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    """Тестирование общего кэша в файле SQLite."""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {})
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_set_get_delete(self):
+        """Проверяем базовые операции и add."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertTrue(self.cache.add('other', 2))
+        self.assertEqual(
+            self.cache.get_many(['key', 'other', 'missing']),
+            {'key': {'value': 1}, 'other': 2}
+        )
+        self.cache.delete_many(['key', 'other'])
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_ttl(self):
+        """Просроченная запись не читается и занимается add."""
+        self.cache.set('key', 1, timeout=-1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_incr_across_processes(self):
+        """incr атомарен для нескольких процессов."""
+        self.cache.set('counter', 0)
+        with ProcessPoolExecutor(max_workers=3) as pool:
+            for future in [
+                pool.submit(increment, self.path, 50) for _ in range(3)
+            ]:
+                future.result()
+        self.assertEqual(self.cache.get('counter'), 150)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_cull_by_size(self):
+        """При превышении размера вытесняются старые записи."""
+        cache = SQLiteCache(
+            self.path, {'OPTIONS': {'MAX_SIZE': 10000, 'CULL_EVERY': 1}}
+        )
+        for number in range(20):
+            cache.set(f'key:{number}', 'x' * 1000)
+        self.assertIsNone(cache.get('key:0'))
+        self.assertIsNotNone(cache.get('key:19'))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'l2': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-cache-test',
+    },
+})
+class TwoTierCacheTest(SimpleTestCase):
+    """Тестирование L1 в памяти процесса перед общим кэшем."""
+
+    def setUp(self):
+        super().setUp()
+        caches['l2'].clear()
+        self.workers = [
+            self.make_worker(location) for location in ('a', 'b')
+        ]
+
+    def tearDown(self):
+        super().tearDown()
+        for location in ('a', 'b'):
+            tiered_cache._memories.pop(location, None)
+
+    def make_worker(self, location, **options):
+        """Отдельный L1, как у другого worker-а, над общим L2."""
+        tiered_cache._memories.pop(location, None)
+        options = {'L2': 'l2', 'CHECK_INTERVAL': 0, **options}
+        return TwoTierCache(location, {'OPTIONS': options})
+
+    def test_hit_served_from_memory(self):
+        """Повторное чтение не обращается к L2."""
+        worker, _ = self.workers
+        worker.set('key', 'value')
+        caches['l2'].set('key', 'changed', version=1)
+        self.assertEqual(worker.get('key'), 'value')
+        self.assertEqual(worker.get_many(['key']), {'key': 'value'})
+
+    def test_mutable_values_are_copied(self):
+        """Изменение полученного объекта не портит L1."""
+        worker, _ = self.workers
+        worker.set('key', {'posts': [1]})
+        worker.get('key')['posts'].append(2)
+        self.assertEqual(worker.get('key'), {'posts': [1]})
+
+    def test_invalidation_across_workers(self):
+        """delete и incr в одном worker-е сбрасывают ключ в L1 других."""
+        first, second = self.workers
+        first.set('generation', 1)
+        self.assertEqual(second.get('generation'), 1)
+        first.incr('generation')
+        self.assertEqual(second.get('generation'), 2)
+        second.get('generation')
+        first.delete('generation')
+        self.assertIsNone(second.get('generation'))
+
+    def test_set_across_workers(self):
+        """Перезапись значения видна другим worker-ам."""
+        first, second = self.workers
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.set('key', 'new')
+        self.assertEqual(second.get('key'), 'new')
+
+    def test_only_changed_keys_dropped(self):
+        """Изменение одного ключа не очищает остальной L1."""
+        first, second = self.workers
+        first.set('kept', 'value')
+        first.set('changed', 1)
+        second.get_many(['kept', 'changed'])
+        caches['l2'].set('kept', 'stale', version=1)
+        first.incr('changed')
+        self.assertEqual(
+            second.get_many(['kept', 'changed']),
+            {'kept': 'value', 'changed': 2}
+        )
+
+    def test_evicted_log_clears_memory(self):
+        """Без записей журнала L1 очищается целиком."""
+        first, second = self.workers
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        caches['l2'].set('key', 'new', version=1)
+        first.delete('other')
+        sequence = caches['l2'].get(tiered_cache.SEQUENCE_KEY)
+        caches['l2'].delete(tiered_cache.LOG_KEY.format(sequence))
+        self.assertEqual(second.get('key'), 'new')
+
+    def test_check_interval(self):
+        """Журнал сверяется не чаще CHECK_INTERVAL."""
+        first, _ = self.workers
+        second = self.make_worker('b', CHECK_INTERVAL=60 * 1000)
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.delete('key')
+        self.assertEqual(second.get('key'), 'old')
+        second.memory.checked = 0.0
+        self.assertIsNone(second.get('key'))
+
+    def test_memory_budget(self):
+        """При превышении MAX_MEMORY вытесняются давние записи."""
+        worker = self.make_worker('a', MAX_MEMORY=250)
+        for key in ('first', 'second', 'third'):
+            worker.set(key, 'x' * 100)
+        self.assertLessEqual(worker.memory.size, 250)
+        self.assertNotIn(worker.make_key('first'), worker.memory.entries)
+        self.assertEqual(worker.get('first'), 'x' * 100)
+
+
+class TwoTierExpiryTest(SimpleTestCase):
+    """Тестирование срока L1 над кэшем SQLite."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'l2': {
+                'BACKEND': 'core.sqlite_cache.SQLiteCache',
+                'LOCATION': os.path.join(directory, 'cache.sqlite3'),
+            },
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        tiered_cache._memories.pop('expiry', None)
+        self.addCleanup(tiered_cache._memories.pop, 'expiry', None)
+        self.worker = TwoTierCache('expiry', {'OPTIONS': {'L2': 'l2'}})
+
+    def test_memory_not_longer_than_l2(self):
+        """Запись из L2 истекает в L1 вместе с L2."""
+        caches['l2'].set('key', 'value', 1, version=1)
+        self.assertEqual(self.worker.get('key'), 'value')
+        expires = self.worker.memory.entries[self.worker.make_key('key')][0]
+        self.assertLessEqual(expires, time.time() + 1)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'refresh-test',
+    },
+})
+class GetOrRefreshTest(SimpleTestCase):
+    """Тестирование пересчёта устаревших записей одним worker-ом."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f'value {self.calls}'
+
+    def test_fresh_entry_not_recomputed(self):
+        """Свежая запись отдаётся без пересчёта."""
+        get_or_refresh('key', self.compute, 60, ['tag'])
+        self.assertEqual(
+            get_or_refresh('key', self.compute, 60, ['tag']), 'value 1'
+        )
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_served_while_locked(self):
+        """Пока другой worker пересчитывает, отдаётся старое значение."""
+        store_entry('key', 'old', {}, 1.0, -1)
+        self.assertTrue(acquire_lock('key'))
+        self.assertEqual(get_or_refresh('key', self.compute, 60), 'old')
+        self.assertEqual(self.calls, 0)
+
+    def test_stale_entry_recomputed_once(self):
+        """Истёкшую запись пересчитывает взявший блокировку."""
+        store_entry('key', 'old', {}, 1.0, -1)
+        self.assertEqual(get_or_refresh('key', self.compute, 60), 'value 1')
+        self.assertEqual(get_or_refresh('key', self.compute, 60), 'value 1')
+        self.assertTrue(acquire_lock('key'))
+
+    def test_invalidated_entry_not_served(self):
+        """После сдвига поколения старое значение не отдаётся."""
+        get_or_refresh('key', self.compute, 60, ['tag'])
+        invalidate_tags('tag')
+        self.assertTrue(acquire_lock('key'))
+        self.assertEqual(
+            get_or_refresh('key', self.compute, 60, ['tag']), 'value 2'
+        )
+        self.assertEqual(
+            get_or_refresh('key', self.compute, 60, ['tag']), 'value 2'
+        )
+        self.assertEqual(self.calls, 2)
+
+    def test_expired_entry_kept_for_stale_reads(self):
+        """Истёкшая запись хранится и считается несвежей."""
+        store_entry('key', 'old', {}, 1.0, -1)
+        entry = cache.get('key')
+        self.assertEqual(entry.value, 'old')
+        self.assertFalse(is_fresh(entry))
+        self.assertEqual(get_or_refresh('key', self.compute, 60), 'value 1')
+
+    def test_early_refresh_probability(self):
+        """Чем ближе срок и дольше расчёт, тем вероятнее пересчёт."""
+        tags = dict(zip(['tag'], get_generations('tag')))
+        far = Entry('value', tags, 0.01, time.time() + 60)
+        near = Entry('value', tags, 10.0, time.time() + 1)
+        self.assertTrue(all(is_fresh(far) for _ in range(100)))
+        self.assertFalse(all(is_fresh(near) for _ in range(100)))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tags-test',
+    },
+})
+class CacheTagsTest(SimpleTestCase):
+    """Тестирование декораторов кэша с тегами."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.calls = []
+
+    def test_cached_function(self):
+        """Результат кэшируется по аргументам до сдвига тега."""
+        @cached(60, 'post:{post_id}')
+        def comments(post_id, page=1):
+            self.calls.append((post_id, page))
+            return [post_id, page]
+
+        self.assertEqual(comments(1), [1, 1])
+        self.assertEqual(comments(post_id=1), [1, 1])
+        self.assertEqual(comments(2), [2, 1])
+        self.assertEqual(len(self.calls), 2)
+        invalidate_tags('post:1')
+        comments(1)
+        comments(2)
+        self.assertEqual(self.calls, [(1, 1), (2, 1), (1, 1)])
+
+    def test_cache_tags_view(self):
+        """Декоратор view помечает запрос тегами из аргументов."""
+        @cache_tags('feed:index', 'post:{post_id}')
+        def view(request, post_id):
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        view(request, post_id=5)
+        self.assertEqual(
+            list(request.cache_tags.values()),
+            get_generations('feed:index', 'post:5')
+        )
+
+
+class ContentAddressedStorageTest(TestCase):
+    """Тестирование хранилища с именами по хешу содержимого."""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.storage = ContentAddressedStorage(location=self.directory)
+
+    def test_sharded_name(self):
+        """Файл лежит в каталогах по первым символам хеша."""
+        name = self.storage.save('posts/Photo.JPG', ContentFile(b'photo'))
+        directory, first, second, filename = name.split('/')
+        self.assertEqual(directory, 'posts')
+        self.assertEqual(filename, first + second + filename[4:])
+        self.assertEqual(len(filename), 64 + len('.jpg'))
+        self.assertTrue(filename.endswith('.jpg'))
+        with self.storage.open(name) as file_:
+            self.assertEqual(file_.read(), b'photo')
+
+    def test_duplicates_share_file(self):
+        """Одинаковое содержимое хранится одним файлом со счётчиком."""
+        first = self.storage.save('posts/a.gif', ContentFile(b'same'))
+        second = self.storage.save('posts/b.gif', ContentFile(b'same'))
+        other = self.storage.save('posts/c.gif', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(StoredFile.objects.get(name=first).references, 2)
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.storage.delete(second)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+        directory = os.path.dirname(self.storage.path(first))
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_untracked_file_kept(self):
+        """Файл без счётчика delete() не трогает."""
+        path = os.path.join(self.directory, 'old.gif')
+        with open(path, 'wb') as file_:
+            file_.write(b'old')
+        self.storage.delete('old.gif')
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+logger = logging.getLogger(__name__)
+
+# Шаблон ключа кэша: миниатюры файла уже готовятся
+PENDING_KEY: str = 'thumbnail:pending:{}'
+
+# Через сколько секунд файл можно поставить в очередь снова,
+# если worker не справился
+PENDING_TIMEOUT: int = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков процесса; создаётся при первой задаче."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails'
+            )
+        return _executor
+
+
+def thumbnail_options(source, options):
+    """
+    Опции с умолчаниями sorl, как в ThumbnailBackend:
+    от них зависит имя файла миниатюры.
+    """
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', default.backend._get_format(source))
+    for key, value in default.backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in default.backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def ready_thumbnail(file_, geometry, **options):
+    """Готовая миниатюра из хранилища sorl или None, без генерации."""
+    source = ImageFile(file_)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, options)
+    )
+    return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def generate(source, presets, key, on_ready):
+    try:
+        for geometry, options in presets:
+            get_thumbnail(source, geometry, **options)
+        if on_ready is not None:
+            on_ready()
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры %s', source.name)
+    finally:
+        # Нулевой срок снимает отметку без сброса L1 кэша
+        cache.touch(key, 0)
+
+
+def generate_in_background(*args):
+    """Задача пула: соединения потока с базой закрываются после неё."""
+    try:
+        generate(*args)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnails(file_, presets=None, on_ready=None):
+    """
+    Готовит миниатюры presets (по умолчанию THUMBNAIL_PRESETS)
+    в фоновом потоке и затем вызывает on_ready. Файл, который
+    уже в работе, повторно не ставится. С THUMBNAIL_WORKERS = 0
+    миниатюры готовятся сразу.
+    """
+    if not file_:
+        return
+    key = PENDING_KEY.format(hashlib.md5(file_.name.encode()).hexdigest())
+    if not cache.add(key, True, PENDING_TIMEOUT):
+        return
+    source = ImageFile(file_.name, file_.storage)
+    presets = presets or settings.THUMBNAIL_PRESETS
+    if not settings.THUMBNAIL_WORKERS:
+        generate(source, presets, key, on_ready)
+        return
+    get_executor().submit(
+        generate_in_background, source, presets, key, on_ready
+    )
+
+
+def regenerate(name, storage, presets, force=False):
+    """
+    Готовит миниатюры presets файла name, с force — удалив
+    прежние. Задача пула процессов regenerate_thumbnails:
+    записи о миниатюрах попадают в хранилище sorl сразу.
+    sorl не сообщает об ошибке чтения картинки, а отдаёт
+    незаписанную миниатюру; здесь это ошибка.
+    """
+    source = ImageFile(name, storage)
+    if force:
+        default.kvstore.delete_thumbnails(source)
+    for geometry, options in presets:
+        thumbnail = get_thumbnail(source, geometry, **options)
+        if not thumbnail.exists():
+            raise OSError(f'Миниатюра {geometry} не записана')
+    return name
@@ -0,0 +1,353 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Ключ L2 с номером последнего изменения в журнале
+SEQUENCE_KEY: str = 'l1:sequence'
+
+# Шаблон ключа L2 с ключом, изменённым под номером журнала
+LOG_KEY: str = 'l1:log:{}'
+
+# Сколько секунд журнал хранит изменение. Процесс, который
+# не сверялся дольше, очищает свой L1 целиком
+LOG_TIMEOUT: int = 60 * 5
+
+# Отставая больше чем на столько изменений, процесс очищает
+# L1 целиком, а не читает журнал
+MAX_LOG_READ: int = 1000
+
+# Память под L1 одного процесса, байт
+MAX_MEMORY: int = 16 * 1024 * 1024
+
+# Не чаще чем раз в столько миллисекунд L1 сверяется с журналом
+CHECK_INTERVAL: int = 500
+
+# Сколько секунд запись живёт в L1, если срок в L2 неизвестен
+L1_TIMEOUT: int = 60
+
+# Типы, которые L1 хранит как есть; остальное хранится
+# сериализованным, чтобы вызывающий код не мог изменить
+# закэшированный объект
+IMMUTABLE_TYPES: tuple = (str, bytes, int, float, bool, type(None))
+
+# L1 общий для всех потоков процесса
+_memories: dict = {}
+_memories_lock = threading.Lock()
+
+
+class Memory:
+    """LRU-словарь процесса с ограничением по памяти."""
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.entries = OrderedDict()
+        self.size = 0
+        # Номер журнала, до которого L1 сверен, и номера
+        # собственных изменений, которые читать не нужно
+        self.sequence = None
+        self.own = set()
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires, sequence=None):
+        """
+        С sequence значение не сохраняется, если L1 успел
+        сверить журнал после чтения значения из L2.
+        """
+        pickled = not isinstance(value, IMMUTABLE_TYPES)
+        if pickled:
+            raw = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            size = len(raw)
+        else:
+            raw = value
+            size = len(value) if isinstance(value, (str, bytes)) else 8
+        if size > self.max_memory:
+            return
+        with self.lock:
+            if sequence is not None and sequence != self.sequence:
+                return
+            self._pop(key)
+            self.entries[key] = (expires, raw, size, pickled)
+            self.size += size
+            while self.size > self.max_memory:
+                self._pop(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def advance(self, sequence, keys=None):
+        """
+        Отмечает L1 сверенным с журналом до sequence: убирает
+        ключи keys, без keys — все записи.
+        """
+        with self.lock:
+            if keys is None:
+                self.entries.clear()
+                self.size = 0
+            else:
+                for key in keys:
+                    self._pop(key)
+            self.own = {number for number in self.own if number > sequence}
+            self.sequence = sequence
+
+    def add_own(self, numbers):
+        with self.lock:
+            self.own.update(numbers)
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+def unpack(entry):
+    """Значение записи L1."""
+    _, raw, _, pickled = entry
+    return pickle.loads(raw) if pickled else raw
+
+
+class TwoTierCache(BaseCache):
+    """
+    Двухуровневый кэш: LRU в памяти процесса (L1) перед
+    общим кэшем из CACHES (L2).
+
+    set, add, delete, incr и touch записывают изменённые ключи
+    в журнал в L2. Остальные процессы читают журнал не чаще
+    CHECK_INTERVAL мс и убирают из своего L1 только эти ключи.
+    Если журнал не дочитать (процесс отстал или записи
+    вытеснены), L1 очищается целиком, как и после clear.
+
+    Запись из L2 живёт в L1 не дольше, чем в L2: срок берётся
+    из get_many_expiring, если L2 его отдаёт (SQLiteCache),
+    иначе запись держится не дольше L1_TIMEOUT.
+
+    OPTIONS: L2 — псевдоним кэша второго уровня, MAX_MEMORY,
+    CHECK_INTERVAL, L1_TIMEOUT.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = options.get('L2', 'shared')
+        self.check_interval = (
+            int(options.get('CHECK_INTERVAL', CHECK_INTERVAL)) / 1000
+        )
+        self.l1_timeout = int(options.get('L1_TIMEOUT', L1_TIMEOUT))
+        with _memories_lock:
+            self.memory = _memories.setdefault(
+                location,
+                Memory(int(options.get('MAX_MEMORY', MAX_MEMORY)))
+            )
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expires(self, expires):
+        """Срок жизни в L1: не дольше L2 и не дольше L1_TIMEOUT."""
+        limit = time.time() + self.l1_timeout
+        return limit if expires is None else min(expires, limit)
+
+    def _sequence(self):
+        sequence = self.l2.get(SEQUENCE_KEY)
+        if sequence is None:
+            # Новое начало от текущего времени не совпадёт
+            # с номером, до которого сверены другие процессы
+            self.l2.add(SEQUENCE_KEY, time.time_ns(), None)
+            sequence = self.l2.get(SEQUENCE_KEY)
+        return sequence
+
+    def _sync(self):
+        """Убирает из L1 ключи, изменённые другими процессами."""
+        memory = self.memory
+        now = time.monotonic()
+        if now - memory.checked < self.check_interval:
+            return
+        memory.checked = now
+        sequence = self._sequence()
+        if sequence == memory.sequence:
+            return
+        if memory.sequence is None or not (
+            0 < sequence - memory.sequence <= MAX_LOG_READ
+        ):
+            memory.advance(sequence)
+            return
+        numbers = [
+            number for number in range(memory.sequence + 1, sequence + 1)
+            if number not in memory.own
+        ]
+        log = self.l2.get_many(
+            [LOG_KEY.format(number) for number in numbers]
+        )
+        # Без части журнала (вытеснена или ещё не записана)
+        # неизвестно, что изменилось, и L1 очищается целиком
+        memory.advance(
+            sequence, log.values() if len(log) == len(numbers) else None
+        )
+
+    def _log(self, *keys):
+        """
+        Записывает изменённые ключи в журнал. Номера берутся
+        атомарным incr, запись журнала появляется после сдвига
+        счётчика: процесс, который её ещё не нашёл, очистит
+        L1 целиком и ничего не пропустит.
+        """
+        try:
+            last = self.l2.incr(SEQUENCE_KEY, len(keys))
+        except ValueError:
+            self._sequence()
+            last = self.l2.incr(SEQUENCE_KEY, len(keys))
+        numbers = range(last - len(keys) + 1, last + 1)
+        self.l2.set_many(
+            {
+                LOG_KEY.format(number): key
+                for number, key in zip(numbers, keys)
+            },
+            LOG_TIMEOUT
+        )
+        self.memory.add_own(numbers)
+
+    def _fetch(self, keys, version):
+        """Значения из L2 со сроками для L1."""
+        sequence = self.memory.sequence
+        get_many_expiring = getattr(self.l2, 'get_many_expiring', None)
+        if get_many_expiring is not None:
+            fetched = get_many_expiring(keys, version=version)
+        else:
+            fetched = {
+                key: (value, None)
+                for key, value in self.l2.get_many(
+                    keys, version=version
+                ).items()
+            }
+        for key, (value, expires) in fetched.items():
+            self.memory.set(
+                self._key(key, version),
+                value,
+                self._expires(expires),
+                sequence
+            )
+        return {key: value for key, (value, _) in fetched.items()}
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        entry = self.memory.get(self._key(key, version))
+        if entry is not None:
+            return unpack(entry)
+        return self._fetch([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found, missing = {}, []
+        for key in keys:
+            entry = self.memory.get(self._key(key, version))
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = unpack(entry)
+        if missing:
+            found.update(self._fetch(missing, version))
+        return found
+
+    def has_key(self, key, version=None):
+        self._sync()
+        if self.memory.get(self._key(key, version)) is not None:
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._sync()
+        self.l2.set(key, value, timeout, version=version)
+        made = self._key(key, version)
+        self._log(made)
+        self.memory.set(
+            made, value, self._expires(self.get_backend_timeout(timeout))
+        )
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._sync()
+        self.l2.set_many(data, timeout, version=version)
+        made = {self._key(key, version): value for key, value in data.items()}
+        if made:
+            self._log(*made)
+        expires = self._expires(self.get_backend_timeout(timeout))
+        for key, value in made.items():
+            self.memory.set(key, value, expires)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._sync()
+        if not self.l2.add(key, value, timeout, version=version):
+            return False
+        made = self._key(key, version)
+        self._log(made)
+        self.memory.set(
+            made, value, self._expires(self.get_backend_timeout(timeout))
+        )
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        made = self._key(key, version)
+        self.memory.delete(made)
+        touched = self.l2.touch(key, timeout, version=version)
+        if touched:
+            self._log(made)
+        return touched
+
+    def delete(self, key, version=None):
+        made = self._key(key, version)
+        self.l2.delete(key, version=version)
+        self.memory.delete(made)
+        self._log(made)
+
+    def delete_many(self, keys, version=None):
+        made = [self._key(key, version) for key in keys]
+        if not made:
+            return
+        self.l2.delete_many(keys, version=version)
+        for key in made:
+            self.memory.delete(key)
+        self._log(*made)
+
+    def incr(self, key, delta=1, version=None):
+        made = self._key(key, version)
+        value = self.l2.incr(key, delta, version=version)
+        self.memory.delete(made)
+        self._log(made)
+        return value
+
+    def clear(self):
+        # Вместе с L2 очищается и журнал: другие процессы
+        # получат новое начало и очистят L1 целиком
+        self.l2.clear()
+        self.memory.clear()
+        self.memory.sequence = None
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
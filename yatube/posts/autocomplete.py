@@ -0,0 +1,188 @@
+import bisect
+import random
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+
+from .models import Group
+
+User = get_user_model()
+
+# Ключ кэша с номером последнего изменения индекса подсказок
+SEQUENCE_KEY: str = 'autocomplete:sequence'
+
+# Ключ кэша со счётчиком номеров, выданных изменениям. Номер
+# выдаётся до записи изменения, а SEQUENCE_KEY сдвигается после
+RESERVED_KEY: str = 'autocomplete:reserved'
+
+# Шаблон ключа кэша с изменением индекса под номером
+CHANGE_KEY: str = 'autocomplete:change:{}'
+
+# Сколько секунд изменения ждут в кэше остальных worker-ов
+CHANGE_TIMEOUT: int = 60 * 60
+
+# Если worker отстал больше чем на столько изменений,
+# индекс строится заново из базы
+MAX_CHANGES: int = 1000
+
+# Сколько подсказок отдавать
+AUTOCOMPLETE_AMOUNT: int = 10
+
+# Адреса страниц для видов подсказок
+KIND_URLS: dict = {
+    'user': 'posts:profile',
+    'group': 'posts:group_list',
+}
+
+
+class PrefixIndex:
+    """
+    Отсортированный список (ключ, вид, значение). Поиск
+    по префиксу — bisect к первому подходящему ключу и срез,
+    без обхода всего списка.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = sorted(self.entry(*item) for item in entries)
+
+    @staticmethod
+    def entry(kind, value):
+        return value.casefold(), kind, value
+
+    def add(self, kind, value):
+        entry = self.entry(kind, value)
+        position = bisect.bisect_left(self.entries, entry)
+        if self.entries[position:position + 1] != [entry]:
+            self.entries.insert(position, entry)
+
+    def remove(self, kind, value):
+        entry = self.entry(kind, value)
+        position = bisect.bisect_left(self.entries, entry)
+        if self.entries[position:position + 1] == [entry]:
+            del self.entries[position]
+
+    def apply(self, change):
+        action, kind, value = change
+        getattr(self, action)(kind, value)
+
+    def search(self, prefix, limit=AUTOCOMPLETE_AMOUNT):
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self.entries, (prefix,))
+        result = []
+        for key, kind, value in self.entries[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            result.append((kind, value))
+        return result
+
+
+# Индекс процесса и номер последнего учтённого изменения
+_index = None
+_sequence = None
+_lock = threading.Lock()
+
+
+def load_entries():
+    """Все имена пользователей и адреса групп из базы."""
+    users = User.objects.values_list('username', flat=True)
+    groups = Group.objects.values_list('slug', flat=True)
+    return [
+        *(('user', username) for username in users.iterator()),
+        *(('group', slug) for slug in groups.iterator()),
+    ]
+
+
+def new_sequence():
+    """
+    Начальный номер журнала. Случайный, чтобы после вытеснения
+    журнала номер не совпал с номером, до которого уже дошёл
+    какой-нибудь worker.
+    """
+    return random.getrandbits(62)
+
+
+def current_sequence():
+    sequence = cache.get(SEQUENCE_KEY)
+    if sequence is None:
+        # Номер вытеснен: продолжаем с выданных номеров,
+        # под которыми записаны изменения
+        cache.add(
+            SEQUENCE_KEY, cache.get(RESERVED_KEY) or new_sequence(), None
+        )
+        sequence = cache.get(SEQUENCE_KEY)
+    return sequence
+
+
+def catch_up(sequence):
+    """
+    Применяет к индексу процесса изменения из кэша.
+    False, если их больше MAX_CHANGES или часть вытеснена.
+    """
+    if _index is None or not 0 < sequence - _sequence <= MAX_CHANGES:
+        return False
+    keys = [
+        CHANGE_KEY.format(number)
+        for number in range(_sequence + 1, sequence + 1)
+    ]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    for key in keys:
+        _index.apply(changes[key])
+    return True
+
+
+def get_index():
+    """Индекс процесса, догнанный до последнего изменения."""
+    global _index, _sequence
+    sequence = current_sequence()
+    with _lock:
+        if _index is not None and sequence == _sequence:
+            return _index
+        if not catch_up(sequence):
+            _index = PrefixIndex(load_entries())
+        _sequence = sequence
+        return _index
+
+
+def record_change(action, kind, value):
+    """
+    Сообщает всем worker-ам об изменении (add или remove);
+    вызывается после коммита. Изменение записывается до сдвига
+    SEQUENCE_KEY. Если номер опубликован раньше, чем записано
+    изменение под ним (другое изменение закончилось быстрее),
+    worker его не найдёт и построит индекс из базы, где
+    изменение уже закоммичено.
+    """
+    try:
+        number = cache.incr(RESERVED_KEY)
+    except ValueError:
+        # Счётчик вытеснен из кэша: новый номер заставит
+        # все worker-ы построить индекс заново
+        sequence = new_sequence()
+        cache.set(RESERVED_KEY, sequence, None)
+        cache.set(SEQUENCE_KEY, sequence, None)
+        return
+    cache.set(
+        CHANGE_KEY.format(number),
+        (action, kind, value),
+        CHANGE_TIMEOUT
+    )
+    try:
+        cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        cache.add(SEQUENCE_KEY, number, None)
+
+
+def suggest(prefix, limit=AUTOCOMPLETE_AMOUNT):
+    """Подсказки авторов и групп, чьё имя начинается с prefix."""
+    return [
+        {
+            'type': kind,
+            'value': value,
+            'url': reverse(KIND_URLS[kind], args=(value,)),
+        }
+        for kind, value in get_index().search(prefix, limit)
+    ]
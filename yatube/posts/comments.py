@@ -0,0 +1,40 @@
+from django.conf import settings
+
+from core.cache import cached
+
+from .models import Comment, Post
+from .utils import COMMENT_CURSOR_FIELDS, CursorPaginator
+
+# Константа, указывающая по сколько комментариев выводить
+COMMENTS_AMOUNT: int = 20
+
+
+def comment_data(comment):
+    """Комментарий в виде словаря для JSON и шаблона."""
+    return {
+        'id': comment.pk,
+        'author': {'username': comment.author.username},
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+    }
+
+
+@cached(settings.POSTS_COMMENTS_CACHE_TIMEOUT, 'post:{post_id}')
+def comment_page(post_id, after=None):
+    """
+    Порция комментариев поста после курсора after, от старых
+    к новым. Кэшируется до изменения поста или его
+    комментариев; None, если поста нет.
+    """
+    if not Post.objects.filter(pk=post_id).exists():
+        return None
+    page = CursorPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        COMMENTS_AMOUNT,
+        fields=COMMENT_CURSOR_FIELDS,
+        descending=False
+    ).get_cursor_page(after=after)
+    return {
+        'comments': [comment_data(comment) for comment in page],
+        'next_cursor': page.next_cursor(),
+    }
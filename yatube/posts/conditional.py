@@ -0,0 +1,111 @@
+import hashlib
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.middleware.csrf import get_token
+
+from core.cache import generation_key
+
+from .models import Group, Post
+
+User = get_user_model()
+
+
+def per_request(func):
+    """Считает состояние один раз на запрос."""
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        states = request.__dict__.setdefault('_conditional_states', {})
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in states:
+            states[key] = func(request, *args, **kwargs)
+        return states[key]
+    return wrapper
+
+
+def make_etag(request, tags, *parts):
+    """
+    ETag из поколений тегов, водяных знаков данных,
+    пользователя и строки запроса. Поколения меняются и при
+    правке постов, которую не видно по датам и id. Страницы
+    пользователя содержат формы, поэтому в ETag входит и
+    CSRF-токен: после входа он новый, и форма со старым
+    токеном не отправится. Без cookie токен выдаётся сразу,
+    и ответ ставит cookie с тем же секретом.
+    """
+    csrf = None
+    if request.user.is_authenticated:
+        # get_token() маскирует токен по-разному при каждом
+        # вызове; в ETag идёт сам секрет из cookie
+        get_token(request)
+        csrf = request.META['CSRF_COOKIE']
+    raw = '|'.join(str(part) for part in (
+        generation_key(*tags),
+        request.user.pk,
+        csrf,
+        request.GET.urlencode(),
+        *parts
+    ))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def post_tags(post_id, author_id, group_id):
+    """Теги страницы поста: в ней видны автор и группа."""
+    tags = [f'post:{post_id}', f'author:{author_id}']
+    if group_id is not None:
+        tags.append(f'group:{group_id}')
+    return tags
+
+
+@per_request
+def index_state(request):
+    latest = Post.objects.order_by('-pk').values_list('pk').first()
+    return ['feed:index'], latest or (None,)
+
+
+@per_request
+def group_state(request, slug):
+    row = Group.objects.filter(slug=slug).annotate(
+        last=Max('posts__pk')
+    ).values_list('pk', 'last').first()
+    if row is None:
+        return None
+    return [f'group:{row[0]}'], row
+
+
+@per_request
+def profile_state(request, username):
+    row = User.objects.filter(username=username).annotate(
+        last=Max('posts__pk')
+    ).values_list('pk', 'last').first()
+    if row is None:
+        return None
+    return [f'author:{row[0]}'], row
+
+
+@per_request
+def post_state(request, post_id):
+    row = Post.objects.filter(pk=post_id).order_by().annotate(
+        last_comment=Max('comments__pk')
+    ).values_list('author_id', 'group_id', 'last_comment').first()
+    if row is None:
+        return None
+    author_id, group_id, _ = row
+    return post_tags(post_id, author_id, group_id), row
+
+
+def etag_func(state_func):
+    """
+    etag_func для декоратора condition. Last-Modified страницы
+    не отдают: даты постов и комментариев не меняются при правке
+    и удалении, и клиент с одним If-Modified-Since получил бы
+    304 на устаревшую страницу.
+    """
+    def func(request, *args, **kwargs):
+        state = state_func(request, *args, **kwargs)
+        if state is None:
+            return None
+        tags, parts = state
+        return make_etag(request, tags, *parts)
+    return func
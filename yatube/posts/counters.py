@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, UserStats
+
+User = get_user_model()
+
+# Поля UserStats и подзапросы, по которым они пересчитываются
+USER_COUNTERS: dict = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def change_user_counter(user_id, field, delta):
+    """Атомарно изменяет счётчик пользователя на delta."""
+    with transaction.atomic():
+        updated = UserStats.objects.filter(
+            user_id=user_id,
+            **{f'{field}__gte': -delta}
+        ).update(**{field: F(field) + delta})
+        if not updated and User.objects.filter(pk=user_id).exists():
+            # Строки нет или счётчик разошёлся с данными. Уменьшение
+            # строку не создаёт: при каскадном удалении пользователя
+            # она уже удалена, а недостающую создаст user_stats()
+            recount_users([user_id], create=delta > 0)
+
+
+def change_comments_counter(post_id, delta):
+    """Атомарно изменяет счётчик комментариев поста на delta."""
+    updated = Post.objects.filter(
+        pk=post_id,
+        comments_count__gte=-delta
+    ).update(comments_count=F('comments_count') + delta)
+    if not updated:
+        recount_posts([post_id])
+
+
+def user_stats(user):
+    """Счётчики пользователя; недостающая строка создаётся пересчётом."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        recount_users([user.pk])
+        return UserStats.objects.get(user=user)
+
+
+def count_subquery(model, field):
+    """Подзапрос количества строк model по полю field."""
+    rows = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(amount=Count('pk'))
+    return Coalesce(Subquery(rows.values('amount')), Value(0))
+
+
+def recount_users(user_ids, create=True):
+    """
+    Пересчитывает счётчики пользователей по данным таблиц.
+    С create=False недостающие строки не создаются.
+    Возвращает количество исправленных строк.
+    """
+    users = User.objects.filter(pk__in=user_ids).annotate(**{
+        field: count_subquery(model, lookup)
+        for field, (model, lookup) in USER_COUNTERS.items()
+    }).values('pk', *USER_COUNTERS)
+    stats = UserStats.objects.in_bulk(user_ids)
+    created, changed = [], []
+    for row in users:
+        values = {field: row[field] for field in USER_COUNTERS}
+        current = stats.get(row['pk'])
+        if current is None:
+            if create:
+                created.append(UserStats(user_id=row['pk'], **values))
+            continue
+        if any(getattr(current, f) != v for f, v in values.items()):
+            for field, value in values.items():
+                setattr(current, field, value)
+            changed.append(current)
+    with transaction.atomic():
+        UserStats.objects.bulk_create(created)
+        UserStats.objects.bulk_update(changed, list(USER_COUNTERS))
+    return len(created) + len(changed)
+
+
+def recount_posts(post_ids):
+    """
+    Пересчитывает счётчики комментариев постов.
+    Возвращает количество исправленных строк.
+    """
+    posts = Post.objects.filter(pk__in=post_ids).annotate(
+        actual=count_subquery(Comment, 'post')
+    ).exclude(actual=F('comments_count')).only('pk', 'comments_count')
+    changed = []
+    for post in posts:
+        post.comments_count = post.actual
+        changed.append(post)
+    Post.objects.bulk_update(changed, ['comments_count'])
+    return len(changed)
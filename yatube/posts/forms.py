@@ -1,4 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+
+from core.images import ingest, validate_image
 
 from .models import Comment, Post
 
@@ -17,6 +20,15 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError('Поле, обязательное для заполнения!')
         return data
 
+    def clean_image(self):
+        """Новая картинка проверяется и перекодируется до сохранения."""
+        data = self.cleaned_data['image']
+
+        if not isinstance(data, UploadedFile):
+            return data
+        validate_image(data)
+        return ingest(data)
+
 
 class CommentForm(forms.ModelForm):
     """Форма для добавления комментария."""
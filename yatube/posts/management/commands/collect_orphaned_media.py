@@ -0,0 +1,261 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+from sorl.thumbnail import default
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from core.models import StoredFile
+from posts.models import Post, PostThumbnail
+
+# Ключ кэша с последним проверенным путём для продолжения
+MARKER_KEY: str = 'media_gc:marker'
+
+# Сколько файлов проверять одним запросом к базе
+BATCH_SIZE: int = 500
+
+# Файлы моложе стольких секунд не удаляются: запись о них
+# может быть ещё в незакоммиченной транзакции
+MIN_AGE: int = 60 * 60 * 24
+
+
+def walk(root, after=''):
+    """
+    Файлы под root как пары (относительный путь, DirEntry)
+    в порядке сортировки путей, после пути after. Каталоги
+    читаются os.scandir по одному, дерево в памяти не хранится.
+    """
+    def visit(directory, prefix):
+        with os.scandir(directory) as entries:
+            # С «/» на конце каталоги сортируются так же,
+            # как пути файлов в них
+            entries = sorted(
+                entries,
+                key=lambda entry: entry.name + (
+                    '/' if entry.is_dir(follow_symlinks=False) else ''
+                )
+            )
+        for entry in entries:
+            path = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                path += '/'
+                # Каталог целиком до маркера пропускается
+                if path < after and not after.startswith(path):
+                    continue
+                yield from visit(entry.path, path)
+            elif entry.is_file(follow_symlinks=False) and path > after:
+                yield path, entry
+
+    if os.path.isdir(root):
+        yield from visit(root, '')
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def media_prefixes():
+    """Каталоги картинок постов и миниатюр sorl под MEDIA_ROOT."""
+    return (
+        Post._meta.get_field('image').upload_to,
+        thumbnail_settings.THUMBNAIL_PREFIX,
+    )
+
+
+def kvstore_thumbnails():
+    """
+    Имена миниатюр, которые sorl записал в kvstore для картинок
+    постов. Миниатюры из async_thumbnail и постов, для которых
+    PostThumbnail не записан, есть только там.
+    """
+    storage = Post._meta.get_field('image').storage
+    kvstore = default.kvstore
+    names = set()
+    images = Post.objects.exclude(image='').values_list(
+        'image', flat=True
+    ).distinct()
+    for image in images.iterator():
+        keys = kvstore._get(
+            ImageFile(image, storage).key, identity='thumbnails'
+        )
+        for key in keys or ():
+            thumbnail = kvstore._get(key)
+            if thumbnail is not None:
+                names.add(thumbnail.name)
+    return names
+
+
+def referenced(names, thumbnails=frozenset()):
+    """
+    Имена из names, на которые ссылаются посты, их миниатюры
+    или счётчики StoredFile. Файл со ссылками в счётчике мог
+    только что получить загрузку того же содержимого, пост
+    которой ещё не записан. thumbnails — миниатюры из kvstore.
+    """
+    return set(
+        Post.objects.filter(image__in=names).values_list('image', flat=True)
+    ) | set(
+        PostThumbnail.objects.filter(name__in=names).values_list(
+            'name', flat=True
+        )
+    ) | set(
+        StoredFile.objects.filter(
+            name__in=names, references__gt=0
+        ).values_list('name', flat=True)
+    ) | thumbnails.intersection(names)
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def delete_orphans(orphans, thumbnails=frozenset()):
+    """
+    Удаляет файлы-сироты {имя: путь} вместе с записями sorl.
+    Счётчики StoredFile блокируются, и ссылки проверяются
+    заново: загрузка того же содержимого, начатая раньше,
+    уже увеличила счётчик, а начатая позже ждёт конца
+    транзакции и пишет файл заново. Возвращает имена
+    удалённых файлов.
+    """
+    storage = Post._meta.get_field('image').storage
+    thumbnail_prefix = thumbnail_settings.THUMBNAIL_PREFIX
+    with transaction.atomic():
+        # Пустое обновление блокирует строки счётчиков, а в
+        # SQLite сразу берёт блокировку на запись, как acquire()
+        StoredFile.objects.filter(name__in=list(orphans)).update(
+            references=F('references')
+        )
+        deleted = set(orphans) - referenced(list(orphans), thumbnails)
+        StoredFile.objects.filter(name__in=deleted).delete()
+        for name in deleted:
+            if name.startswith(thumbnail_prefix):
+                default.kvstore.delete(ImageFile(name, default.storage))
+            else:
+                delete_thumbnails(ImageFile(name, storage), delete_file=False)
+            remove(orphans[name])
+    return deleted
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки постов и миниатюры, '
+        'на которые больше ничего не ссылается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы-сироты'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько файлов проверять одним запросом'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='Сколько файлов проверить за запуск; 0 — все'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=MIN_AGE,
+            help='Не трогать файлы моложе стольких секунд'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать с начала, а не с сохранённого маркера'
+        )
+
+    @cached_property
+    def thumbnails(self):
+        return kvstore_thumbnails()
+
+    def orphans(self, batch, options):
+        """
+        Файлы партии из каталогов постов старше --min-age,
+        на которые нет ссылок: {имя: путь}.
+        """
+        prefixes = media_prefixes()
+        deadline = time.time() - options['min_age']
+        candidates = {
+            name: entry.path for name, entry in batch
+            if name.startswith(prefixes)
+            and entry.stat().st_mtime < deadline
+        }
+        used = referenced(
+            list(candidates), self.batch_thumbnails(candidates)
+        )
+        orphans = {
+            name: path for name, path in candidates.items()
+            if name not in used
+        }
+        if options['dry_run'] or options['verbosity'] > 1:
+            for name in orphans:
+                self.stdout.write(name)
+        return orphans
+
+    def batch_thumbnails(self, names):
+        """Миниатюры из kvstore, если в партии есть миниатюры."""
+        prefix = thumbnail_settings.THUMBNAIL_PREFIX
+        if any(name.startswith(prefix) for name in names):
+            return self.thumbnails
+        return frozenset()
+
+    def handle(self, *args, **options):
+        marker = '' if options['restart'] else cache.get(MARKER_KEY, '')
+        files = walk(settings.MEDIA_ROOT, marker)
+        if options['limit']:
+            files = islice(files, options['limit'])
+        checked = orphaned = deleted = 0
+        last = marker
+        for batch in batches(files, options['batch_size']):
+            orphans = self.orphans(batch, options)
+            if orphans and not options['dry_run']:
+                deleted += len(
+                    delete_orphans(orphans, self.batch_thumbnails(orphans))
+                )
+            checked += len(batch)
+            orphaned += len(orphans)
+            last = batch[-1][0]
+            if not options['dry_run']:
+                cache.set(MARKER_KEY, last, None)
+        self.finish(options, last, marker)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}, без ссылок: {orphaned}, '
+            f'удалено: {deleted}'
+        ))
+
+    def finish(self, options, last, marker):
+        """Маркер сбрасывается, когда обход дошёл до конца."""
+        if options['dry_run']:
+            return
+        exhausted = not options['limit'] or next(
+            walk(settings.MEDIA_ROOT, last), None
+        ) is None
+        if exhausted:
+            cache.delete(MARKER_KEY)
+        elif last != marker:
+            self.stdout.write(f'Продолжение с {last}')
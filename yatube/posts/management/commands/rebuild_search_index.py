@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts.search import FTS_TABLE, ensure_triggers, fts_available
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов.'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite')
+        # Триггеры пропадают, когда миграция пересоздаёт
+        # posts_post; без них индекс не следит за записью
+        for name in ensure_triggers():
+            self.stdout.write(f'Создан триггер {name}')
+        with connection.cursor() as cursor:
+            # Индекс читает тексты из posts_post заново,
+            # optimize сливает его сегменты в один
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+            )
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+            total = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {total}'
+        ))
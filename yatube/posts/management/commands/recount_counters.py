@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.counters import recount_posts, recount_users
+from posts.models import Post
+
+User = get_user_model()
+
+# Сколько строк пересчитывать за один проход
+BATCH_SIZE: int = 1000
+
+
+def id_batches(queryset, batch_size):
+    """Идёт по id таблицы пачками без OFFSET."""
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').values_list(
+                'pk', flat=True
+            )[:batch_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, комментариев и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько строк пересчитывать за один проход'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = sum(
+            recount_users(ids)
+            for ids in id_batches(User.objects.all(), batch_size)
+        )
+        posts = sum(
+            recount_posts(ids)
+            for ids in id_batches(Post.objects.all(), batch_size)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: пользователей {users}, постов {posts}'
+        ))
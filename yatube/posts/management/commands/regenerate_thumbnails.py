@@ -0,0 +1,172 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.cache import invalidate_tags
+from core.thumbnails import regenerate
+from posts.conditional import post_tags
+from posts.models import Post
+from posts.thumbnails import store_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Ключ кэша с id последнего обработанного поста
+MARKER_KEY: str = 'thumbnails:regenerate:marker'
+
+# Сколько постов читать и обрабатывать за раз
+CHUNK_SIZE: int = 100
+
+
+def post_chunks(after, size):
+    """
+    Посты с картинками порциями по id после after:
+    списки (id, картинка, автор, группа).
+    """
+    posts = Post.objects.exclude(image='').order_by('pk').values_list(
+        'pk', 'image', 'author_id', 'group_id'
+    )
+    while True:
+        chunk = list(posts.filter(pk__gt=after)[:size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Готовит заново миниатюры THUMBNAIL_PRESETS для всех '
+        'картинок постов и записывает их к постам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько постов обрабатывать за раз'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Сколько процессов готовят миниатюры; 0 — без пула'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Удалить и подготовить заново уже готовые миниатюры'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать с первого поста, а не с сохранённого маркера'
+        )
+
+    def generate(self, pool, names, force):
+        """
+        Готовит миниатюры файлов names в пуле или сразу.
+        Возвращает имена файлов, для которых всё получилось.
+        """
+        storage = Post._meta.get_field('image').storage
+        arguments = (storage, settings.THUMBNAIL_PRESETS, force)
+        if pool is None:
+            tasks = [
+                (name, partial(regenerate, name, *arguments))
+                for name in names
+            ]
+        else:
+            futures = {
+                pool.submit(regenerate, name, *arguments): name
+                for name in names
+            }
+            tasks = [
+                (futures[future], future.result)
+                for future in as_completed(futures)
+            ]
+        ready = set()
+        for name, result in tasks:
+            try:
+                result()
+            except Exception:
+                logger.exception('Не удалось подготовить миниатюры %s', name)
+                self.stderr.write(f'Ошибка: {name}')
+            else:
+                ready.add(name)
+        return ready
+
+    def process(self, pool, chunk, force):
+        """
+        Миниатюры порции и записи о них. Возвращает число
+        готовых постов и id постов, для которых не получилось.
+        """
+        ready = self.generate(pool, {row[1] for row in chunk}, force)
+        tags = {'feed:index'}
+        done, failed = 0, []
+        for pk, name, author_id, group_id in chunk:
+            if name not in ready:
+                failed.append(pk)
+                continue
+            store_thumbnails(pk, name)
+            tags.update(post_tags(pk, author_id, group_id))
+            done += 1
+        invalidate_tags(*tags)
+        return done, failed
+
+    def handle(self, *args, **options):
+        after = 0 if options['restart'] else cache.get(MARKER_KEY, 0)
+        pool = None
+        if options['workers']:
+            # Процессы запускаются через spawn и настраивают
+            # Django сами; соединения родителя им не достаются
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        started = time.monotonic()
+        total = 0
+        failed = []
+        try:
+            for chunk in post_chunks(after, options['chunk_size']):
+                done, chunk_failed = self.process(
+                    pool, chunk, options['force']
+                )
+                total += done
+                failed.extend(chunk_failed)
+                # Маркер не уходит дальше первого поста с ошибкой:
+                # следующий запуск начнёт с него
+                cache.set(
+                    MARKER_KEY,
+                    failed[0] - 1 if failed else chunk[-1][0],
+                    None
+                )
+                rate = total / max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f'До поста {chunk[-1][0]}: готово {total}, '
+                    f'{rate:.1f} постов/с'
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if failed:
+            self.stderr.write(
+                'Не удалось для постов: '
+                + ', '.join(str(pk) for pk in failed)
+            )
+        else:
+            cache.delete(MARKER_KEY)
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры готовы для постов: {total} за '
+            f'{time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_thumbnail'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='postthumbnail',
+            name='thumbnail_unique_post_geometry',
+        ),
+        migrations.AddField(
+            model_name='postthumbnail',
+            name='format',
+            field=models.CharField(default='JPEG', max_length=10, verbose_name='Формат'),
+        ),
+        migrations.AddConstraint(
+            model_name='postthumbnail',
+            constraint=models.UniqueConstraint(fields=('post', 'geometry', 'format'), name='thumbnail_unique_post_geometry_format'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from sorl.thumbnail import default
+
+from core.storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -47,18 +50,70 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Количество комментариев',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date'],
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:POST_STR_AMOUNT]
 
 
+class PostThumbnail(models.Model):
+    """
+    Готовая миниатюра картинки поста: ленты берут адреса
+    и размеры отсюда, без хранилища sorl на каждый пост.
+    """
+
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Пост',
+        on_delete=models.CASCADE,
+        related_name='thumbnails'
+    )
+    geometry = models.CharField('Размер', max_length=50)
+    format = models.CharField('Формат', max_length=10, default='JPEG')
+    name = models.CharField('Файл миниатюры', max_length=255)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+
+    class Meta:
+        verbose_name = 'Миниатюра поста'
+        verbose_name_plural = 'Миниатюры постов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'geometry', 'format'],
+                name='thumbnail_unique_post_geometry_format'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def url(self):
+        return default.storage.url(self.name)
+
+
 class Group(models.Model):
     """Модель Group."""
 
@@ -95,6 +150,14 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.text[:COMMENT_STR_AMOUNT]
 
@@ -114,3 +177,83 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following'
     )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='follow_unique_user_author'
+            ),
+        ]
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: пост автора, разосланный
+    подписчику при публикации (fan-out on write).
+    """
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель ленты',
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Пост',
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    pub_date = models.DateTimeField(
+        'Дата публикации поста',
+        help_text='Копия Post.pub_date для сортировки ленты'
+    )
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date'],
+                name='feed_user_pub_date_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='feed_unique_user_post'
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, обновляемые при записи."""
+
+    user = models.OneToOneField(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField(
+        'Количество постов',
+        default=0
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0
+    )
+    following_count = models.PositiveIntegerField(
+        'Количество подписок',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return str(self.user)
@@ -0,0 +1,207 @@
+import base64
+import binascii
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+
+from .models import Post
+
+# Таблица полнотекстового индекса постов (FTS5)
+FTS_TABLE: str = 'posts_post_fts'
+
+# Сколько слов запроса учитывать
+MAX_TERMS: int = 10
+
+# Сколько слов текста показывать во фрагменте
+SNIPPET_WORDS: int = 16
+
+# Служебные символы вокруг найденных слов во фрагменте:
+# подсветка добавляется после экранирования текста
+MARK_START: str = '\x02'
+MARK_END: str = '\x03'
+
+# Триггеры, которые обновляют индекс при записи в posts_post.
+# SQLite удаляет их вместе с таблицей, когда миграция
+# пересоздаёт posts_post, поэтому они создаются и здесь
+FTS_TRIGGERS: dict = {
+    f'{FTS_TABLE}_insert': (
+        'AFTER INSERT ON posts_post BEGIN'
+        f' INSERT INTO {FTS_TABLE} (rowid, text) VALUES (new.id, new.text);'
+        ' END'
+    ),
+    f'{FTS_TABLE}_delete': (
+        'AFTER DELETE ON posts_post BEGIN'
+        f' INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text)'
+        " VALUES ('delete', old.id, old.text);"
+        ' END'
+    ),
+    f'{FTS_TABLE}_update': (
+        'AFTER UPDATE OF text ON posts_post BEGIN'
+        f' INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text)'
+        " VALUES ('delete', old.id, old.text);"
+        f' INSERT INTO {FTS_TABLE} (rowid, text) VALUES (new.id, new.text);'
+        ' END'
+    ),
+}
+
+SEARCH_SQL = (
+    f'SELECT p.id, bm25({FTS_TABLE}), '
+    f"snippet({FTS_TABLE}, 0, %s, %s, '…', %s) "
+    f'FROM {FTS_TABLE} JOIN posts_post p ON p.id = {FTS_TABLE}.rowid '
+    f'WHERE {FTS_TABLE} MATCH %s AND (bm25({FTS_TABLE}), p.id) > (%s, %s) '
+    f'ORDER BY bm25({FTS_TABLE}), p.id LIMIT %s'
+)
+
+
+def fts_available():
+    """Полнотекстовый индекс создаётся миграцией только в SQLite."""
+    return connection.vendor == 'sqlite'
+
+
+def ensure_triggers(using=DEFAULT_DB_ALIAS):
+    """
+    Создаёт недостающие триггеры индекса, если сам индекс
+    есть. Возвращает имена созданных триггеров.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master "
+            "WHERE (type = 'table' AND name = %s) "
+            "OR (type = 'trigger' AND tbl_name = 'posts_post')",
+            [FTS_TABLE]
+        )
+        existing = {name for _, name in cursor.fetchall()}
+        if FTS_TABLE not in existing:
+            return []
+        created = [name for name in FTS_TRIGGERS if name not in existing]
+        for name in created:
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {name} {FTS_TRIGGERS[name]}'
+            )
+    return created
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из пользовательского текста: слова берутся
+    в кавычки, поэтому операторы FTS5 в тексте не работают.
+    Пустая строка, если слов нет.
+    """
+    terms = re.findall(r'\w+', text)[:MAX_TERMS]
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def filter_matching(queryset, text):
+    """
+    Оставляет в queryset постов подходящие под запрос.
+    RawSQL в pk__in Django оборачивает в лишние скобки,
+    и SQLite берёт из подзапроса только первую строку.
+    """
+    return queryset.extra(
+        where=[
+            f'posts_post.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[fts_query(text)]
+    )
+
+
+def encode_search_cursor(rank, pk):
+    raw = f'{rank!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_search_cursor(token):
+    """Пара (ранг, id) из токена; None для повреждённого токена."""
+    if not token:
+        return None
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(token + padding).decode()
+        rank, pk = raw.split('|')
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def highlight(snippet):
+    """Экранирует фрагмент и подсвечивает найденные слова."""
+    return mark_safe(escape(snippet).replace(
+        MARK_START, '<mark>'
+    ).replace(MARK_END, '</mark>'))
+
+
+class SearchPage:
+    """Страница результатов поиска с курсором на следующую."""
+
+    def __init__(self, posts, next_cursor):
+        self.object_list = posts
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def rank_posts(query, after, amount):
+    """
+    Посты по рангу BM25 (у лучших он меньше) через индекс.
+    Курсор — пара (ранг, id) последнего поста страницы.
+    """
+    rank, pk = after or (float('-inf'), 0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SEARCH_SQL,
+            (MARK_START, MARK_END, SNIPPET_WORDS, query, rank, pk,
+             amount + 1)
+        )
+        rows = cursor.fetchall()
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [row[0] for row in rows[:amount]]
+    )
+    result = []
+    for post_id, rank, snippet in rows[:amount]:
+        post = posts[post_id]
+        post.snippet = highlight(snippet)
+        post.rank = rank
+        result.append(post)
+    next_cursor = None
+    if len(rows) > amount:
+        next_cursor = encode_search_cursor(result[-1].rank, result[-1].pk)
+    return SearchPage(result, next_cursor)
+
+
+def filter_posts(text, after, amount):
+    """Поиск без индекса: icontains, от новых постов к старым."""
+    _, pk = after or (None, None)
+    posts = Post.objects.select_related('author', 'group').filter(
+        text__icontains=text
+    ).order_by('-pk')
+    if pk is not None:
+        posts = posts.filter(pk__lt=pk)
+    posts = list(posts[:amount + 1])
+    for post in posts:
+        post.snippet = escape(Truncator(post.text).words(SNIPPET_WORDS))
+    next_cursor = None
+    if len(posts) > amount:
+        next_cursor = encode_search_cursor(0.0, posts[amount - 1].pk)
+    return SearchPage(posts[:amount], next_cursor)
+
+
+def search_posts(text, after=None, amount=10):
+    """
+    Страница результатов поиска после курсора after.
+    Без слов в запросе — пустая страница.
+    """
+    query = fts_query(text)
+    if not query:
+        return SearchPage([], None)
+    after = decode_search_cursor(after)
+    if fts_available():
+        return rank_posts(query, after, amount)
+    return filter_posts(text, after, amount)
@@ -0,0 +1,331 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_init, post_migrate,
+                                      post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from core import cache as tag_cache
+from core.thumbnails import schedule_thumbnails
+
+from . import autocomplete, counters, search, timeline, utils
+from .models import Comment, Follow, Group, Post, PostThumbnail, UserStats
+from .thumbnails import store_thumbnails
+
+User = get_user_model()
+
+# Поля пользователя, которые видны на страницах
+USER_DISPLAY_FIELDS: tuple = ('username', 'first_name', 'last_name')
+
+
+def post_ids(post, field):
+    """Текущее и исходное значения поля поста (author_id, group_id)."""
+    values = {getattr(post, field), getattr(post, f'_initial_{field}', None)}
+    values.discard(None)
+    return values
+
+
+def feed_tags(post):
+    """Теги кэша лент и страницы поста, которые затрагивает пост."""
+    tags = {'feed:index', f'post:{post.pk}'}
+    tags.update(f'author:{pk}' for pk in post_ids(post, 'author_id'))
+    tags.update(f'group:{pk}' for pk in post_ids(post, 'group_id'))
+    return tags
+
+
+def group_tags(group):
+    """
+    Название группы видно в карточках постов, поэтому вместе
+    с группой устаревают главная лента и профили её авторов.
+    Страницы постов помечены тегом группы сами.
+    """
+    tags = {'feed:index', f'group:{group.pk}'}
+    authors = Post.objects.filter(group=group).order_by().values_list(
+        'author_id', flat=True
+    ).distinct()
+    tags.update(f'author:{pk}' for pk in authors)
+    return tags
+
+
+def post_scopes(post, pulled=None):
+    """
+    Ленты, в которые попадает пост, для сброса счётчиков.
+    pulled — уже известный результат is_pulled() для автора.
+    """
+    scopes = {'index', f'author:{post.author_id}'}
+    scopes.update(f'group:{pk}' for pk in post_ids(post, 'group_id'))
+    if pulled is None:
+        pulled = timeline.is_pulled(post.author_id)
+    if pulled:
+        # Ленты с такими авторами собираются при чтении
+        # и не кэшируют количество постов
+        return scopes
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    scopes.update(f'follow:{user_id}' for user_id in followers)
+    return scopes
+
+
+def now_and_on_commit(func, *args):
+    """
+    Сбрасывает кэш сразу и, внутри транзакции, ещё раз после
+    коммита. Читатель между сигналом и коммитом запоминает
+    новое поколение и читает старые строки; второй сброс
+    делает его запись в кэше устаревшей.
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(func, *args))
+
+
+def invalidate_tags(*tags):
+    now_and_on_commit(tag_cache.invalidate_tags, *tags)
+
+
+def invalidate_counts(*scopes):
+    now_and_on_commit(utils.invalidate_counts, *scopes)
+
+
+def record_change(action, kind, value):
+    """
+    Изменение подсказок записывается после коммита: откаченная
+    запись не добавляет и не убирает подсказку.
+    """
+    transaction.on_commit(
+        partial(autocomplete.record_change, action, kind, value)
+    )
+
+
+def rename(kind, old, new):
+    """Переносит подсказку со старого имени на новое."""
+    if old == new:
+        return
+    if old is not None:
+        record_change('remove', kind, old)
+    record_change('add', kind, new)
+
+
+def user_display(user):
+    """Видимые на страницах поля пользователя."""
+    return tuple(user.__dict__.get(field) for field in USER_DISPLAY_FIELDS)
+
+
+def user_tags(user):
+    """
+    Имя автора видно в его постах: в лентах, на страницах
+    постов и групп, где он писал.
+    """
+    tags = {'feed:index', f'author:{user.pk}'}
+    groups = Post.objects.filter(
+        author=user, group__isnull=False
+    ).order_by().values_list('group_id', flat=True).distinct()
+    tags.update(f'group:{pk}' for pk in groups)
+    return tags
+
+
+@receiver(post_init, sender=User)
+def remember_user_state(sender, instance, **kwargs):
+    instance._initial_username = instance.__dict__.get('username')
+    instance._initial_display = user_display(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif user_display(instance) != instance._initial_display:
+        # Сохранение last_login при входе кэш не сбрасывает
+        invalidate_tags(*user_tags(instance))
+    rename(
+        'user',
+        None if created else instance._initial_username,
+        instance.username
+    )
+    instance._initial_username = instance.username
+    instance._initial_display = user_display(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    record_change('remove', 'user', instance.username)
+
+
+@receiver(post_init, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    """Запоминаем исходные группу и автора, чтобы сбросить их ленты."""
+    instance._initial_group_id = instance.__dict__.get('group_id')
+    instance._initial_author_id = instance.__dict__.get('author_id')
+    instance._initial_image = str(instance.__dict__.get('image') or '')
+
+
+def thumbnails_ready(post_id, name, tags):
+    """Готовые миниатюры записываются к посту, кэш лент сбрасывается."""
+    store_thumbnails(post_id, name)
+    invalidate_tags(*tags)
+
+
+def prepare_thumbnails(post):
+    """
+    Миниатюры новой картинки готовятся в фоне после коммита,
+    когда файл и запись уже сохранены. Готовые миниатюры
+    сбрасывают кэш лент и страницы поста.
+    """
+    image = post.image
+    if (image.name or '') == post._initial_image:
+        return
+    if post._initial_image:
+        PostThumbnail.objects.filter(post=post).delete()
+    if not image:
+        return
+    on_ready = partial(
+        thumbnails_ready, post.pk, image.name, feed_tags(post)
+    )
+    transaction.on_commit(
+        lambda: schedule_thumbnails(image, on_ready=on_ready)
+    )
+
+
+def release_image(storage, name):
+    """Ссылка на картинку снимается после коммита удаления или замены."""
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(pre_save, sender=Post)
+def remember_upload(sender, instance, **kwargs):
+    """Картинка загружается при сохранении и берёт новую ссылку."""
+    image = instance.image
+    instance._image_uploaded = bool(image) and not image._committed
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counter(instance.author_id, 'posts_count', 1)
+    elif instance.author_id != instance._initial_author_id:
+        counters.recount_users(
+            [instance.author_id, instance._initial_author_id]
+        )
+    pulled = timeline.is_pulled(instance.author_id) if created else None
+    if created or instance.group_id != instance._initial_group_id:
+        invalidate_counts(*post_scopes(instance, pulled))
+    if created:
+        timeline.forget_recent_posts(instance.author_id)
+        timeline.fan_out(instance, pulled)
+    invalidate_tags(*feed_tags(instance))
+    prepare_thumbnails(instance)
+    # Та же картинка, загруженная заново, получила вторую ссылку
+    # под прежним именем; снимается ссылка прежней картинки
+    if (
+        instance._image_uploaded
+        or (instance.image.name or '') != instance._initial_image
+    ):
+        release_image(instance.image.storage, instance._initial_image)
+    instance._initial_group_id = instance.group_id
+    instance._initial_author_id = instance.author_id
+    instance._initial_image = instance.image.name or ''
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'posts_count', -1)
+    invalidate_counts(*post_scopes(instance))
+    timeline.forget_recent_posts(instance.author_id)
+    invalidate_tags(*feed_tags(instance))
+    release_image(instance.image.storage, instance.image.name)
+
+
+def comment_changed(comment):
+    """Счётчик комментариев виден в карточках лент."""
+    post = Post.objects.filter(pk=comment.post_id).first()
+    if post is not None:
+        invalidate_tags(*feed_tags(post))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_counter(instance.post_id, 1)
+    comment_changed(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comments_counter(instance.post_id, -1)
+    comment_changed(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    invalidate_counts(f'follow:{instance.user_id}')
+    invalidate_tags(
+        f'author:{instance.author_id}', f'author:{instance.user_id}'
+    )
+    if created:
+        counters.change_user_counter(
+            instance.author_id, 'followers_count', 1
+        )
+        counters.change_user_counter(
+            instance.user_id, 'following_count', 1
+        )
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+def push_author(author_id):
+    """Посты автора расходятся по лентам, их количество меняется."""
+    followers = timeline.push_author(author_id)
+    invalidate_counts(*(f'follow:{user_id}' for user_id in followers))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'followers_count', -1)
+    counters.change_user_counter(instance.user_id, 'following_count', -1)
+    invalidate_counts(f'follow:{instance.user_id}')
+    invalidate_tags(
+        f'author:{instance.author_id}', f'author:{instance.user_id}'
+    )
+    timeline.remove_author(instance.user_id, instance.author_id)
+    if timeline.left_pulled(instance.author_id):
+        transaction.on_commit(partial(push_author, instance.author_id))
+
+
+@receiver(post_init, sender=Group)
+def remember_slug(sender, instance, **kwargs):
+    instance._initial_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_tags(*group_tags(instance))
+    rename(
+        'group',
+        None if created else instance._initial_slug,
+        instance.slug
+    )
+    instance._initial_slug = instance.slug
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_tags(sender, instance, **kwargs):
+    """После удаления группы её посты уже не найти по группе."""
+    instance._cache_tags = group_tags(instance)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_tags(*instance._cache_tags)
+    record_change('remove', 'group', instance.slug)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """
+    Миграция, пересоздавшая posts_post в SQLite, молча удаляет
+    триггеры полнотекстового индекса; они создаются заново.
+    """
+    if sender.name == 'posts' and connections[using].vendor == 'sqlite':
+        search.ensure_triggers(using)
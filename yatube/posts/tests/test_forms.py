@@ -1,3 +1,4 @@
+import io
 import shutil
 import tempfile
 
@@ -6,6 +7,9 @@ from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+
+from core import images
 
 from ..models import Comment, Group, Post
 
@@ -162,3 +166,169 @@ class PostFormTests(TestCase):
                 )
             )
         )
+
+
+def photo(size, exif=True):
+    """JPEG-файл с EXIF, как с камеры телефона."""
+    image = Image.new('RGB', size, 'red')
+    metadata = Image.Exif()
+    if exif:
+        # Модель камеры
+        metadata[0x0110] = 'Test camera'
+    content = io.BytesIO()
+    image.save(content, 'JPEG', exif=metadata.tobytes())
+    return SimpleUploadedFile(
+        name='photo.jpg',
+        content=content.getvalue(),
+        content_type='image/jpeg'
+    )
+
+
+def animation(size, frames=3):
+    """Анимированный GIF с комментарием в метаданных."""
+    images = [
+        Image.new('RGB', size, color) for color in ('red', 'green', 'blue')
+    ][:frames]
+    content = io.BytesIO()
+    images[0].save(
+        content,
+        'GIF',
+        save_all=True,
+        append_images=images[1:],
+        duration=100,
+        loop=0,
+        comment=b'Test camera'
+    )
+    return SimpleUploadedFile(
+        name='animation.gif',
+        content=content.getvalue(),
+        content_type='image/gif'
+    )
+
+
+class ImageIngestTests(TestCase):
+    """Тестирование обработки картинок при загрузке."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        self.user = User.objects.create(username='testuser')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def create(self, image):
+        return self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с фото', 'image': image}
+        )
+
+    @override_settings(IMAGE_MAX_DIMENSION=100)
+    def test_downsized_without_exif(self):
+        """Фото уменьшается и сохраняется без EXIF прогрессивным JPEG."""
+        self.create(photo((300, 200)))
+        post = Post.objects.get(author=self.user)
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 67))
+            self.assertNotIn('exif', image.info)
+            self.assertTrue(image.info.get('progressive'))
+
+    @override_settings(IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels_rejected(self):
+        """Картинка с огромным числом пикселей не принимается."""
+        response = self.create(photo((20, 10), exif=False))
+        self.assertFormError(
+            response,
+            'form',
+            'image',
+            'Слишком большая картинка: 20×10.'
+        )
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+    @override_settings(IMAGE_MAX_SIZE=10)
+    def test_large_file_rejected(self):
+        """Слишком большой файл не принимается."""
+        self.create(photo((20, 10)))
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+    @override_settings(IMAGE_MAX_DIMENSION=100)
+    def test_animation_reencoded(self):
+        """Анимация уменьшается покадрово и теряет метаданные."""
+        self.create(animation((300, 200)))
+        post = Post.objects.get(author=self.user)
+        self.assertTrue(post.image.name.endswith('.gif'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 67))
+            self.assertEqual(image.n_frames, 3)
+            self.assertEqual(image.info.get('duration'), 100)
+            self.assertNotIn('comment', image.info)
+
+    @override_settings(IMAGE_MAX_PIXELS=500)
+    def test_too_many_frames_rejected(self):
+        """Анимация не принимается по числу пикселей во всех кадрах."""
+        response = self.create(animation((20, 10)))
+        self.assertFormError(
+            response,
+            'form',
+            'image',
+            'Слишком много кадров: 3.'
+        )
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+
+@override_settings(IMAGE_WORKERS=1)
+class ImagePoolTests(TestCase):
+    """Тестирование пула процессов, перекодирующего картинки."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        # Каждый тест начинает с нового пула в один процесс
+        self.reset()
+        self.addCleanup(self.reset)
+        self.user = User.objects.create(username='testuser')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def reset(self):
+        if images._executor is not None:
+            images.reset_executor(images._executor)
+
+    def create(self):
+        return self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с фото', 'image': photo((30, 20))}
+        )
+
+    def test_broken_pool_replaced(self):
+        """Упавший процесс не ломает следующие загрузки."""
+        self.create()
+        executor = images._executor
+        for process in list(executor._processes.values()):
+            process.kill()
+            process.join()
+        response = self.create()
+        self.assertFormError(
+            response, 'form', 'image', 'Не удалось обработать картинку.'
+        )
+        self.assertIsNot(images._executor, executor)
+        self.create()
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 2)
+
+    @override_settings(IMAGE_TIMEOUT=0.001)
+    def test_timeout_replaces_pool(self):
+        """Пул с зависшей задачей заменяется, его процессы завершаются."""
+        response = self.create()
+        self.assertFormError(
+            response, 'form', 'image', 'Не удалось обработать картинку.'
+        )
+        self.assertIsNone(images._executor)
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
@@ -1,7 +1,27 @@
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.models import StoredFile
 
-from ..models import POST_STR_AMOUNT, Group, Post
+from ..management.commands import regenerate_thumbnails
+from ..management.commands.collect_orphaned_media import MARKER_KEY
+from ..models import (POST_STR_AMOUNT, Comment, Follow, Group, Post,
+                      PostThumbnail, UserStats)
+from ..search import FTS_TABLE, FTS_TRIGGERS, search_posts
 
 User = get_user_model()
 
@@ -77,3 +97,365 @@ class PostModelTest(TestCase):
                     post._meta.get_field(field).help_text,
                     value
                 )
+
+
+class QueryPlanTest(TestCase):
+    """Проверяем, что запросы лент используют индексы."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='testuser')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug_01',
+            description='Тестовое описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            group=cls.group,
+            text='Тестовый пост'
+        )
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row) for row in cursor.fetchall())
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты, комментарии и подписки читаются по индексам."""
+        queries = {
+            'post_author_pub_date_idx': self.user.posts.all(),
+            'post_group_pub_date_idx': self.group.posts.all(),
+            'comment_post_created_idx': Comment.objects.filter(
+                post=self.post
+            ).order_by('created'),
+        }
+        for index, queryset in queries.items():
+            with self.subTest(index=index):
+                plan = self.query_plan(queryset)
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_follow_lookup_uses_unique_index(self):
+        """Подписка ищется по уникальному индексу (user, author)."""
+        plan = self.query_plan(
+            Follow.objects.filter(user=self.user, author=self.user)
+        )
+        self.assertIn('INDEX', plan)
+        self.assertNotIn('SCAN', plan)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка нарушает ограничение уникальности."""
+        author = User.objects.create(username='author')
+        Follow.objects.create(user=self.user, author=author)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Follow.objects.create(user=self.user, author=author)
+
+
+class CountersTest(TestCase):
+    """Тестирование денормализованных счётчиков."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.author.stats.refresh_from_db()
+        self.reader.stats.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.author.stats.posts_count, 1)
+        self.assertEqual(self.author.stats.followers_count, 1)
+        self.assertEqual(self.reader.stats.following_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.author.stats.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.author.stats.followers_count, 0)
+
+    def test_recount_command_repairs_drift(self):
+        """Команда recount_counters исправляет расхождения."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        Post.objects.filter(pk=post.pk).update(comments_count=5)
+        out = StringIO()
+        call_command('recount_counters', batch_size=1, stdout=out)
+        post.refresh_from_db()
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertIn('пользователей 1, постов 1', out.getvalue())
+
+
+class UserDeletionTest(TransactionTestCase):
+    """Тестирование удаления пользователя со связанными записями."""
+
+    def test_delete_user_with_posts_and_follows(self):
+        """Каскад не воссоздаёт счётчики удаляемого пользователя."""
+        author = User.objects.create(username='author')
+        reader = User.objects.create(username='reader')
+        post = Post.objects.create(author=author, text='Тестовый пост')
+        other = Post.objects.create(author=reader, text='Чужой пост')
+        Comment.objects.create(post=post, author=author, text='Свой')
+        Comment.objects.create(post=other, author=author, text='Чужой')
+        Follow.objects.create(user=author, author=reader)
+        Follow.objects.create(user=reader, author=author)
+        author.delete()
+        self.assertFalse(User.objects.filter(pk=author.pk).exists())
+        self.assertFalse(UserStats.objects.filter(user=author.pk).exists())
+        other.refresh_from_db()
+        reader.stats.refresh_from_db()
+        self.assertEqual(other.comments_count, 0)
+        self.assertEqual(reader.stats.followers_count, 0)
+        self.assertEqual(reader.stats.following_count, 0)
+        self.assertEqual(reader.stats.posts_count, 1)
+
+
+class SearchIndexTest(TestCase):
+    """Тестирование полнотекстового индекса постов."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+
+    def found(self, text):
+        return [post.pk for post in search_posts(text)]
+
+    def test_index_follows_writes(self):
+        """Триггеры обновляют индекс при создании, правке и удалении."""
+        post = Post.objects.create(author=self.author, text='Утренний кофе')
+        self.assertEqual(self.found('кофе'), [post.pk])
+        post.text = 'Вечерний чай'
+        post.save()
+        self.assertEqual(self.found('кофе'), [])
+        self.assertEqual(self.found('ЧАЙ'), [post.pk])
+        post.delete()
+        self.assertEqual(self.found('чай'), [])
+
+    def test_rebuild_command(self):
+        """Команда rebuild_search_index восстанавливает индекс."""
+        post = Post.objects.create(author=self.author, text='Утренний кофе')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')"
+            )
+        self.assertEqual(self.found('кофе'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertEqual(self.found('кофе'), [post.pk])
+        self.assertIn('Проиндексировано постов: 1', out.getvalue())
+
+    def test_rebuild_restores_triggers(self):
+        """
+        Команда создаёт триггеры, удалённые при пересоздании
+        posts_post, и индекс снова следит за записью.
+        """
+        with connection.cursor() as cursor:
+            for name in FTS_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER {name}')
+        post = Post.objects.create(author=self.author, text='Утренний кофе')
+        self.assertEqual(self.found('кофе'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn(f'Создан триггер {FTS_TABLE}_insert', out.getvalue())
+        post.text = 'Вечерний чай'
+        post.save()
+        self.assertEqual(self.found('чай'), [post.pk])
+
+
+class OrphanedMediaTest(TestCase):
+    """Тестирование сборки файлов без ссылок."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        user = User.objects.create(username='testuser')
+        self.post = Post.objects.create(author=user, text='Пост')
+        self.post.image.save('photo.gif', ContentFile(b'photo'))
+        PostThumbnail.objects.create(
+            post=self.post,
+            geometry='960x339',
+            name='cache/aa/bb/used.jpg',
+            width=960,
+            height=339
+        )
+        self.files = {
+            name: self.create(name) for name in (
+                'cache/aa/bb/used.jpg',
+                'cache/aa/cc/orphan.jpg',
+                'posts/00/00/orphan.gif',
+                'posts/ff/ff/orphan.gif',
+                'other/keep.txt',
+            )
+        }
+        self.files[self.post.image.name] = self.post.image.path
+        self.age(self.post.image.path)
+
+    def create(self, name):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file_:
+            file_.write(name.encode())
+        self.age(path)
+        return path
+
+    def age(self, path):
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(path, (old, old))
+
+    def existing(self):
+        return {
+            name for name, path in self.files.items()
+            if os.path.exists(path)
+        }
+
+    def collect(self, **options):
+        out = StringIO()
+        call_command('collect_orphaned_media', stdout=out, **options)
+        return out.getvalue()
+
+    def test_orphans_deleted(self):
+        """Удаляются только картинки и миниатюры без ссылок."""
+        fresh = self.create('posts/12/34/fresh.gif')
+        os.utime(fresh, None)
+        output = self.collect()
+        self.assertIn('без ссылок: 3', output)
+        self.assertEqual(self.existing(), {
+            'cache/aa/bb/used.jpg',
+            'other/keep.txt',
+            self.post.image.name,
+        })
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_stored_file_references_kept(self):
+        """
+        Файл со ссылками в StoredFile не удаляется: загрузка
+        того же содержимого ещё не записала свой пост.
+        """
+        name = 'posts/00/00/orphan.gif'
+        StoredFile.objects.create(name=name, references=1)
+        self.collect()
+        self.assertIn(name, self.existing())
+        self.assertTrue(StoredFile.objects.filter(name=name).exists())
+
+    def test_kvstore_thumbnails_kept(self):
+        """Миниатюры картинок постов, записанные только в kvstore, живут."""
+        source = ImageFile(self.post.image)
+        thumbnail = ImageFile('cache/aa/cc/orphan.jpg', default.storage)
+        for image in (source, thumbnail):
+            image.set_size((1, 1))
+        default.kvstore.set(source)
+        default.kvstore.set(thumbnail, source=source)
+        output = self.collect()
+        self.assertIn('без ссылок: 2', output)
+        self.assertIn('cache/aa/cc/orphan.jpg', self.existing())
+
+    def test_dry_run(self):
+        """С --dry-run файлы только перечисляются."""
+        output = self.collect(dry_run=True)
+        self.assertIn('posts/00/00/orphan.gif', output)
+        self.assertEqual(self.existing(), set(self.files))
+
+    def test_resume_from_marker(self):
+        """С --limit обход продолжается с места остановки."""
+        self.collect(limit=2, batch_size=1)
+        self.assertEqual(cache.get(MARKER_KEY), 'cache/aa/cc/orphan.jpg')
+        self.assertIn('posts/00/00/orphan.gif', self.existing())
+        self.collect(limit=2)
+        self.assertEqual(cache.get(MARKER_KEY), 'posts/00/00/orphan.gif')
+        self.assertNotIn('posts/00/00/orphan.gif', self.existing())
+        self.collect()
+        self.assertIsNone(cache.get(MARKER_KEY))
+        self.assertNotIn('posts/ff/ff/orphan.gif', self.existing())
+
+
+class RegenerateThumbnailsTest(TestCase):
+    """Тестирование пересборки миниатюр всех постов."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        user = User.objects.create(username='testuser')
+        Post.objects.create(author=user, text='Без картинки')
+        self.posts = []
+        # У первых двух постов одна и та же картинка
+        for width in (2, 2, 3):
+            post = Post.objects.create(author=user, text='С картинкой')
+            post.image.save('image.gif', ContentFile(self.gif(width)))
+            self.posts.append(post)
+
+    def gif(self, width):
+        content = BytesIO()
+        Image.new('RGB', (width, 1)).save(content, 'GIF')
+        return content.getvalue()
+
+    def regenerate(self, **options):
+        out = StringIO()
+        call_command(
+            'regenerate_thumbnails', workers=0, stdout=out, **options
+        )
+        return out.getvalue()
+
+    def test_all_variants_stored(self):
+        """Все варианты картинок записываются к постам."""
+        output = self.regenerate(chunk_size=2)
+        self.assertIn('постов/с', output)
+        self.assertIn('Миниатюры готовы для постов: 3', output)
+        for post in self.posts:
+            self.assertEqual(
+                post.thumbnails.count(), len(settings.THUMBNAIL_PRESETS)
+            )
+        self.assertIsNone(cache.get(regenerate_thumbnails.MARKER_KEY))
+
+    def test_resume_from_marker(self):
+        """Обработка продолжается после поста из маркера."""
+        cache.set(regenerate_thumbnails.MARKER_KEY, self.posts[1].pk, None)
+        self.regenerate()
+        self.assertEqual(
+            [post.thumbnails.exists() for post in self.posts],
+            [False, False, True]
+        )
+        self.regenerate(restart=True)
+        self.assertTrue(all(post.thumbnails.exists() for post in self.posts))
+
+    def test_marker_stops_at_failed_post(self):
+        """
+        Маркер остаётся перед первым постом с ошибкой, id таких
+        постов выводятся в конце, остальные посты обрабатываются.
+        """
+        with open(self.posts[0].image.path, 'wb') as file_:
+            file_.write(b'not an image')
+        errors = StringIO()
+        output = self.regenerate(chunk_size=1, force=True, stderr=errors)
+        self.assertIn('Миниатюры готовы для постов: 1', output)
+        self.assertIn(
+            f'Не удалось для постов: {self.posts[0].pk}, {self.posts[1].pk}',
+            errors.getvalue()
+        )
+        self.assertEqual(
+            cache.get(regenerate_thumbnails.MARKER_KEY), self.posts[0].pk - 1
+        )
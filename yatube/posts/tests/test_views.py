@@ -1,15 +1,30 @@
+import io
 import shutil
 import tempfile
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.db import IntegrityError, connection, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
+from core.cache import get_generations
+from core.models import StoredFile
+from core.thumbnails import ready_thumbnail
+
+from ..autocomplete import CHANGE_KEY, SEQUENCE_KEY, suggest
+from ..comments import COMMENTS_AMOUNT, comment_page
 from ..forms import PostForm
-from ..models import Follow, Group, Post
+from ..models import Comment, FeedEntry, Follow, Group, Post, PostThumbnail
+from ..utils import (ELLIPSIS, CachedCountPaginator, count_cache_key,
+                     encode_cursor, estimate_count)
 from ..views import POSTS_AMOUNT
 
 User = get_user_model()
@@ -26,7 +41,7 @@ ALL_POSTS_AMOUNT: int = POSTS_AMOUNT + P2_POSTS_AMOUNT
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
 class PostPagesTests(TestCase):
     """Тестирование страниц приложения Post."""
 
@@ -183,7 +198,8 @@ class CacheTest(TestCase):
     """Тестирование cache."""
 
     def setUp(self):
-        super().setUp
+        super().setUp()
+        cache.clear()
         self.user = User.objects.create(username='testuser')
         self.group = Group.objects.create(
             title='Тестовая группа',
@@ -204,7 +220,7 @@ class CacheTest(TestCase):
             reverse('posts:index')
         )
         content_1 = response_1.content
-        self.post.delete()
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
         response_2 = self.client.get(
             reverse('posts:index')
         )
@@ -217,6 +233,64 @@ class CacheTest(TestCase):
         self.assertEqual(content_1, content_2)
         self.assertNotEqual(content_1, content_3)
 
+    def test_cache_invalidated_by_signals(self):
+        """Изменение и удаление поста сбрасывают кэш лент."""
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+        )
+        for address in addresses:
+            self.client.get(address)
+        self.post.text = 'Отредактированный пост'
+        self.post.save()
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertContains(
+                    self.client.get(address), 'Отредактированный пост'
+                )
+        self.post.delete()
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertNotContains(
+                    self.client.get(address), 'Отредактированный пост'
+                )
+
+    def test_cache_varies_by_page(self):
+        """Разные страницы ленты кэшируются отдельно."""
+        for number in range(POSTS_AMOUNT):
+            Post.objects.create(
+                author=self.user,
+                text=f'Пост номер {number}'
+            )
+        page_1 = self.client.get(reverse('posts:index'))
+        page_2 = self.client.get(reverse('posts:index'), {'page': 2})
+        self.assertContains(page_1, f'Пост номер {POSTS_AMOUNT - 1}')
+        self.assertContains(page_2, 'Тестовый пост')
+        self.assertNotContains(page_2, f'Пост номер {POSTS_AMOUNT - 1}')
+
+
+class CommitInvalidationTest(TransactionTestCase):
+    """Тестирование сброса кэша после коммита."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+
+    def test_reader_before_commit_outdated(self):
+        """
+        Поколение и счётчик, прочитанные до коммита нового
+        поста, устаревают после коммита.
+        """
+        key = count_cache_key('index')
+        with transaction.atomic():
+            Post.objects.create(author=self.user, text='Тестовый пост')
+            seen = get_generations('feed:index')
+            cache.set(key, 0)
+        self.assertNotEqual(get_generations('feed:index'), seen)
+        self.assertIsNone(cache.get(key))
+
 
 class FollowsTest(TestCase):
     """Тестирование подписок."""
@@ -421,3 +495,1066 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']),
                     amount
                 )
+
+
+@override_settings(POSTS_CURSOR_PAGINATION=True)
+class CursorPaginatorViewsTest(TestCase):
+    """Тестирование курсорного пагинатора."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='testuser')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.posts = [
+            Post.objects.create(
+                author=self.user,
+                group=self.group,
+                text='Тестовый пост'
+            ) for _ in range(ALL_POSTS_AMOUNT)
+        ]
+
+    def test_cursor_pages(self):
+        """Проверяем переходы вперёд и назад по токенам."""
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test_slug'}),
+            reverse('posts:profile', kwargs={'username': 'testuser'}),
+        )
+        for address in addresses:
+            with self.subTest(address=address):
+                first = self.client.get(address).context['page_obj']
+                self.assertEqual(len(first), POSTS_AMOUNT)
+                self.assertFalse(first.has_previous())
+                second = self.client.get(
+                    address, {'after': first.next_cursor()}
+                ).context['page_obj']
+                self.assertEqual(len(second), P2_POSTS_AMOUNT)
+                self.assertFalse(second.has_next())
+                back = self.client.get(
+                    address, {'before': second.previous_cursor()}
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_new_post_keeps_order(self):
+        """Новый пост не сдвигает следующую страницу."""
+        address = reverse('posts:index')
+        first = self.client.get(address).context['page_obj']
+        token = first.next_cursor()
+        Post.objects.create(author=self.user, text='Свежий пост')
+        second = self.client.get(
+            address, {'after': token}
+        ).context['page_obj']
+        self.assertEqual(
+            [post.pk for post in second],
+            [post.pk for post in self.posts[:P2_POSTS_AMOUNT]][::-1]
+        )
+
+    def test_out_of_range_cursor(self):
+        """Токен за краем ленты отдаёт крайнюю страницу."""
+        oldest = Post(pub_date=self.posts[0].pub_date, pk=0)
+        newest = Post(pub_date=timezone.now() + timedelta(days=1), pk=0)
+        cases = (
+            ('after', encode_cursor(oldest), POSTS_AMOUNT, True, False),
+            ('before', encode_cursor(newest), POSTS_AMOUNT, False, True),
+        )
+        for param, token, amount, has_previous, has_next in cases:
+            with self.subTest(param=param):
+                response = self.client.get(
+                    reverse('posts:index'), {param: token}
+                )
+                self.assertEqual(response.status_code, 200)
+                page = response.context['page_obj']
+                self.assertEqual(len(page), amount)
+                self.assertEqual(page.has_previous(), has_previous)
+                self.assertEqual(page.has_next(), has_next)
+
+    def test_stale_cursor(self):
+        """Токен, за которым посты удалены, не ломает страницу."""
+        first = self.client.get(reverse('posts:index')).context['page_obj']
+        token = first.next_cursor()
+        Post.objects.filter(
+            pk__in=[post.pk for post in self.posts[:P2_POSTS_AMOUNT]]
+        ).delete()
+        page = self.client.get(
+            reverse('posts:index'), {'after': token}
+        ).context['page_obj']
+        self.assertEqual(len(page), POSTS_AMOUNT)
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor())
+        self.assertFalse(page.has_previous())
+
+    def test_empty_feed_cursor(self):
+        """В пустой ленте у страницы нет токенов."""
+        Post.objects.all().delete()
+        page = self.client.get(
+            reverse('posts:index'), {'after': '%%%'}
+        ).context['page_obj']
+        self.assertEqual(len(page), 0)
+        self.assertIsNone(page.next_cursor())
+        self.assertIsNone(page.previous_cursor())
+
+    def test_broken_cursor(self):
+        """Повреждённый токен отдаёт первую страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'after': '%%%'}
+        )
+        self.assertEqual(
+            len(response.context['page_obj']),
+            POSTS_AMOUNT
+        )
+
+
+class CachedCountTest(TestCase):
+    """Тестирование кэширования количества постов."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Тестовый пост'
+        )
+
+    def test_group_count_is_cached(self):
+        """Повторный запрос группы не считает посты заново."""
+        address = reverse('posts:group_list', args=(self.group.slug,))
+        self.client.get(address)
+        key = count_cache_key(f'group:{self.group.pk}')
+        self.assertEqual(cache.get(key), 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(address)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries)
+        )
+
+    def test_profile_count_from_counter(self):
+        """Профиль берёт количество постов из счётчика."""
+        address = reverse('posts:profile', args=(self.user.username,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(address)
+        self.assertEqual(response.context['count'], 1)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries)
+        )
+
+    def test_count_invalidated(self):
+        """Создание и удаление поста сбрасывает счётчики."""
+        address = reverse('posts:group_list', args=(self.group.slug,))
+        self.client.get(address)
+        Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Второй пост'
+        )
+        response = self.client.get(address)
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        self.post.delete()
+        response = self.client.get(address)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+
+    @override_settings(POSTS_COUNT_EXACT_LIMIT=2)
+    def test_estimated_count(self):
+        """Большие ленты считаются по диапазону id."""
+        for _ in range(3):
+            Post.objects.create(author=self.user, text='Тестовый пост')
+        Post.objects.filter(pk=self.post.pk + 1).delete()
+        self.assertEqual(estimate_count(Post.objects.all()), 4)
+        self.assertEqual(
+            estimate_count(Post.objects.filter(group=self.group)), 1
+        )
+
+    @override_settings(POSTS_COUNT_EXACT_LIMIT=2)
+    def test_filtered_count_is_exact(self):
+        """Лента автора среди чужих постов не переоценивается."""
+        other = User.objects.create(username='other')
+        for _ in range(3):
+            Post.objects.create(author=other, text='Чужой пост')
+            Post.objects.create(author=self.user, text='Тестовый пост')
+        self.assertEqual(
+            estimate_count(Post.objects.filter(author=self.user)), 4
+        )
+
+
+class ElidedPageRangeTest(TestCase):
+    """Тестирование сокращённой навигации по страницам."""
+
+    def test_elided_page_range(self):
+        """Проверяем края и окно вокруг текущей страницы."""
+        paginator = CachedCountPaginator(range(1000), 10)
+        ranges = {
+            1: [1, 2, 3, ELLIPSIS, 100],
+            5: [1, 2, 3, 4, 5, 6, 7, ELLIPSIS, 100],
+            50: [1, ELLIPSIS, 48, 49, 50, 51, 52, ELLIPSIS, 100],
+            100: [1, ELLIPSIS, 98, 99, 100],
+        }
+        for number, expected in ranges.items():
+            with self.subTest(number=number):
+                self.assertEqual(
+                    list(paginator.get_elided_page_range(number)),
+                    expected
+                )
+
+    def test_short_range(self):
+        """Короткая лента выводится целиком."""
+        paginator = CachedCountPaginator(range(30), 10)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(2)),
+            [1, 2, 3]
+        )
+
+    def test_template_renders_window(self):
+        """Шаблон выводит только окно страниц."""
+        user = User.objects.create(username='testuser')
+        Post.objects.bulk_create(
+            Post(author=user, text='Тестовый пост')
+            for _ in range(POSTS_AMOUNT * 20)
+        )
+        response = self.client.get(reverse('posts:index'), {'page': 10})
+        content = response.content.decode()
+        self.assertIn('?page=11', content)
+        self.assertNotIn('?page=5"', content)
+        self.assertIn(ELLIPSIS, content)
+
+
+@override_settings(POSTS_TIMELINE_LENGTH=3, POSTS_TIMELINE_SLACK=1)
+class TimelineTest(TestCase):
+    """Тестирование ленты подписок с рассылкой при публикации."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_fan_out_and_trim(self):
+        """Новые посты попадают в ленту, лента ограничена."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(author=self.author, text='Тестовый пост')
+            for _ in range(5)
+        ]
+        entries = FeedEntry.objects.filter(user=self.reader)
+        self.assertEqual(entries.count(), 3)
+        self.assertEqual(
+            list(entries.values_list('post_id', flat=True)),
+            [post.pk for post in posts[:-4:-1]]
+        )
+
+    def test_backfill_and_remove(self):
+        """Подписка дозаполняет ленту, отписка очищает её."""
+        for _ in range(4):
+            Post.objects.create(author=self.author, text='Тестовый пост')
+        self.client.get(
+            reverse('posts:profile_follow', args=(self.author.username,))
+        )
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 3)
+        self.client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,))
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+
+    def test_follow_index_single_query(self):
+        """Лента подписок читается одним запросом к постам."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='Тестовый пост')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('posts:follow_index'))
+        post_queries = [
+            query['sql'] for query in queries
+            if 'FROM "posts_post"' in query['sql']
+            and 'COUNT(' not in query['sql']
+        ]
+        self.assertEqual(len(post_queries), 1)
+        self.assertIn('posts_feedentry', post_queries[0])
+
+
+@override_settings(POSTS_FANOUT_FOLLOWERS_LIMIT=2)
+class HybridTimelineTest(TestCase):
+    """Тестирование смешанной ленты для популярных авторов."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.star = User.objects.create(username='star')
+        self.author = User.objects.create(username='author')
+        self.reader = User.objects.create(username='reader')
+        self.fan = User.objects.create(username='fan')
+        for user in (self.reader, self.fan):
+            Follow.objects.create(user=user, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_star_posts_not_pushed(self):
+        """Посты популярного автора не рассылаются по лентам."""
+        Post.objects.create(author=self.star, text='Тестовый пост')
+        Post.objects.create(author=self.author, text='Тестовый пост')
+        self.assertEqual(
+            FeedEntry.objects.filter(post__author=self.star).count(), 0
+        )
+        self.assertEqual(
+            FeedEntry.objects.filter(post__author=self.author).count(), 1
+        )
+
+    def test_merged_feed(self):
+        """Лента сливает разосланные и подмешанные посты по дате."""
+        posts = [
+            Post.objects.create(author=author, text='Тестовый пост')
+            for author in (self.star, self.author, self.star, self.author)
+        ]
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            posts[::-1]
+        )
+        self.assertEqual(response.context['page_obj'].paginator.count, 4)
+
+
+@override_settings(POSTS_FANOUT_FOLLOWERS_LIMIT=2)
+class TimelineThresholdTest(TransactionTestCase):
+    """Тестирование перехода автора через порог рассылки."""
+
+    def test_posts_pushed_below_threshold(self):
+        """Посты, написанные выше порога, остаются в ленте ниже него."""
+        star = User.objects.create(username='star')
+        reader = User.objects.create(username='reader')
+        fan = User.objects.create(username='fan')
+        Follow.objects.create(user=reader, author=star)
+        follow = Follow.objects.create(user=fan, author=star)
+        post = Post.objects.create(author=star, text='Тестовый пост')
+        self.assertFalse(FeedEntry.objects.exists())
+        follow.delete()
+        client = Client()
+        client.force_login(reader)
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post])
+        self.assertTrue(
+            FeedEntry.objects.filter(user=reader, post=post).exists()
+        )
+
+
+class AnonymousPageCacheTest(TestCase):
+    """Тестирование кэша страниц для анонимных читателей."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        self.post = Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Тестовый пост'
+        )
+        self.other = Post.objects.create(
+            author=User.objects.create(username='other'),
+            text='Чужой пост'
+        )
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_anonymous_pages_cached(self):
+        """Повторный анонимный запрос не рендерит шаблон."""
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertIsNotNone(
+                    self.guest_client.get(address).context
+                )
+                self.assertIsNone(self.guest_client.get(address).context)
+
+    def test_authorized_not_cached(self):
+        """Авторизованные пользователи получают свежую страницу."""
+        address = reverse('posts:post_detail', args=(self.post.pk,))
+        self.authorized_client.get(address)
+        self.assertIsNotNone(self.authorized_client.get(address).context)
+
+    def test_purge_by_scope(self):
+        """Изменение поста сбрасывает только связанные страницы."""
+        post_page = reverse('posts:post_detail', args=(self.post.pk,))
+        other_page = reverse('posts:post_detail', args=(self.other.pk,))
+        self.guest_client.get(post_page)
+        self.guest_client.get(other_page)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        response = self.guest_client.get(post_page)
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Комментарий')
+        self.assertIsNone(self.guest_client.get(other_page).context)
+
+    def test_purge_by_group(self):
+        """Изменение группы сбрасывает страницы с её постами."""
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        for address in addresses:
+            self.guest_client.get(address)
+        self.group.slug = 'new_slug'
+        self.group.save()
+        new_link = reverse('posts:group_list', args=('new_slug',))
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertContains(self.guest_client.get(address), new_link)
+        other_page = reverse('posts:post_detail', args=(self.other.pk,))
+        self.guest_client.get(other_page)
+        self.group.delete()
+        self.assertIsNone(self.guest_client.get(other_page).context)
+        self.assertNotContains(
+            self.guest_client.get(reverse('posts:index')), new_link
+        )
+
+
+class ConditionalGetTest(TestCase):
+    """Тестирование ответов 304 Not Modified."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        self.post = Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Тестовый пост'
+        )
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+
+    def test_not_modified(self):
+        """Повторный запрос с ETag отдаёт 304 без шаблонов."""
+        for address in self.addresses:
+            with self.subTest(address=address):
+                etag = self.client.get(address)['ETag']
+                response = self.client.get(
+                    address, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_modified_after_edit(self):
+        """Правка поста меняет ETag всех его страниц."""
+        etags = {
+            address: self.client.get(address)['ETag']
+            for address in self.addresses
+        }
+        self.post.text = 'Отредактированный пост'
+        self.post.save()
+        for address, etag in etags.items():
+            with self.subTest(address=address):
+                response = self.client.get(
+                    address, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_modified_after_comment(self):
+        """Новый комментарий меняет ETag страницы поста."""
+        address = reverse('posts:post_detail', args=(self.post.pk,))
+        etag = self.client.get(address)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_modified_after_comment_edit(self):
+        """Правка комментария меняет ETag страницы поста."""
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        address = reverse('posts:post_detail', args=(self.post.pk,))
+        etag = self.client.get(address)['ETag']
+        comment.text = 'Исправленный комментарий'
+        comment.save()
+        response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_modified_after_author_rename(self):
+        """Новое имя автора меняет ETag страниц с его постами."""
+        etags = {
+            address: self.client.get(address)['ETag']
+            for address in self.addresses
+        }
+        self.user.first_name = 'Лев'
+        self.user.save()
+        for address, etag in etags.items():
+            with self.subTest(address=address):
+                response = self.client.get(
+                    address, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_after_login(self):
+        """Запись last_login при входе не сбрасывает кэш лент."""
+        generations = get_generations('feed:index')
+        self.client.force_login(self.user)
+        self.assertEqual(get_generations('feed:index'), generations)
+
+    def test_modified_after_csrf_rotation(self):
+        """
+        Новый CSRF-токен после входа меняет ETag: форма
+        комментария со старым токеном не отправится.
+        """
+        address = reverse('posts:post_detail', args=(self.post.pk,))
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 64
+        etag = self.client.get(address)['ETag']
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'b' * 64
+        response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_last_modified(self):
+        """
+        Даты постов не меняются при правке, поэтому страницы
+        отдают только ETag, и If-Modified-Since не даёт 304.
+        """
+        for address in self.addresses:
+            with self.subTest(address=address):
+                response = self.client.get(address)
+                self.assertFalse(response.has_header('Last-Modified'))
+                response = self.client.get(
+                    address,
+                    HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_cached_page_not_modified(self):
+        """Страница из кэша для гостей тоже отвечает 304."""
+        guest_client = Client()
+        address = reverse('posts:index')
+        etag = guest_client.get(address)['ETag']
+        response = guest_client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class PostDetailQueriesTest(TestCase):
+    """Тестирование числа запросов страницы поста."""
+
+    # Сессия, пользователь, состояние для ETag,
+    # пост с автором и группой, страница комментариев
+    QUERIES: int = 5
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание'
+        )
+        self.post = Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Тестовый пост'
+        )
+        self.address = reverse('posts:post_detail', args=(self.post.pk,))
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def add_comments(self, amount):
+        start = Comment.objects.count()
+        Comment.objects.bulk_create(
+            Comment(
+                post=self.post,
+                author=User.objects.create(username=f'commenter{number}'),
+                text=f'Комментарий {number}'
+            )
+            for number in range(start, start + amount)
+        )
+
+    def test_out_of_range_comment_cursor(self):
+        """Токен старше всех комментариев отдаёт первую порцию."""
+        self.add_comments(COMMENTS_AMOUNT + 1)
+        token = encode_cursor(
+            Comment(created=timezone.now() - timedelta(days=1), pk=0),
+            ('created', 'pk')
+        )
+        response = self.authorized_client.get(
+            self.address, {'before': token}
+        )
+        self.assertEqual(response.status_code, 200)
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.pk for comment in comments],
+            list(self.post.comments.order_by('created', 'pk').values_list(
+                'pk', flat=True
+            )[:COMMENTS_AMOUNT])
+        )
+
+    def test_queries_do_not_depend_on_comments(self):
+        """Число запросов не растёт с числом комментариев."""
+        self.add_comments(1)
+        with self.assertNumQueries(self.QUERIES):
+            self.authorized_client.get(self.address)
+        self.add_comments(COMMENTS_AMOUNT * 2)
+        with self.assertNumQueries(self.QUERIES):
+            response = self.authorized_client.get(self.address)
+        self.assertEqual(len(response.context['comments']), COMMENTS_AMOUNT)
+
+    def test_comments_paginated_by_cursor(self):
+        """Комментарии листаются от старых к новым без повторов."""
+        self.add_comments(COMMENTS_AMOUNT + 1)
+        response = self.authorized_client.get(self.address)
+        first_page = response.context['comments']
+        self.assertTrue(first_page.has_next())
+        response = self.authorized_client.get(
+            self.address, {'after': first_page.next_cursor()}
+        )
+        second_page = response.context['comments']
+        self.assertFalse(second_page.has_next())
+        seen = [comment.pk for comment in first_page]
+        seen += [comment.pk for comment in second_page]
+        self.assertEqual(
+            seen,
+            list(self.post.comments.order_by(
+                'created', 'pk'
+            ).values_list('pk', flat=True))
+        )
+
+
+class CommentsEndpointTest(TestCase):
+    """Тестирование подгрузки комментариев."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='testuser')
+        self.post = Post.objects.create(author=self.user, text='Тестовый пост')
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, text=f'Комментарий {i}')
+            for i in range(COMMENTS_AMOUNT + 1)
+        )
+        self.address = reverse('posts:post_comments', args=(self.post.pk,))
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_json_continues_post_page(self):
+        """JSON отдаёт комментарии после первой порции страницы поста."""
+        first_page = self.authorized_client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        ).context['comments']
+        response = self.authorized_client.get(
+            self.address,
+            {'after': first_page.next_cursor(), 'format': 'json'}
+        )
+        data = response.json()
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(
+            [comment.pk for comment in first_page]
+            + [comment['id'] for comment in data['comments']],
+            list(self.post.comments.order_by(
+                'created', 'pk'
+            ).values_list('pk', flat=True))
+        )
+
+    def test_html_fragment(self):
+        """Фрагмент содержит комментарии и ссылку на следующие."""
+        response = self.authorized_client.get(self.address)
+        self.assertTemplateUsed(response, 'posts/includes/comments.html')
+        self.assertContains(response, 'Комментарий', COMMENTS_AMOUNT)
+        self.assertContains(response, 'js-more-comments')
+
+    def test_cached_and_invalidated_by_add_comment(self):
+        """Порция кэшируется и сбрасывается новым комментарием."""
+        after = comment_page(self.post.pk)['next_cursor']
+        comment_page(self.post.pk, after)
+        with self.assertNumQueries(0):
+            comment_page(self.post.pk, after)
+        self.authorized_client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Свежий комментарий'}
+        )
+        data = self.authorized_client.get(
+            self.address, {'after': after, 'format': 'json'}
+        ).json()
+        self.assertEqual(data['comments'][-1]['text'], 'Свежий комментарий')
+
+    def test_missing_post(self):
+        """Для несуществующего поста — 404."""
+        response = self.authorized_client.get(
+            reverse('posts:post_comments', args=(self.post.pk + 1,))
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchViewTest(TestCase):
+    """Тестирование поиска по постам."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='testuser', is_staff=True,
+                                        is_superuser=True)
+        self.often = Post.objects.create(
+            author=self.user, text='Кот, кот и ещё раз кот'
+        )
+        self.once = Post.objects.create(
+            author=self.user,
+            text='Длинный рассказ о погоде, в котором где-то есть кот'
+        )
+        Post.objects.create(author=self.user, text='Про <собак>')
+        self.guest_client = Client()
+
+    def test_ranked_with_snippets(self):
+        """Результаты упорядочены по BM25 и подсвечены."""
+        response = self.guest_client.get(reverse('posts:search'), {'q': 'кот'})
+        page = response.context['page_obj']
+        self.assertEqual(
+            [post.pk for post in page], [self.often.pk, self.once.pk]
+        )
+        self.assertContains(response, '<mark>кот</mark>')
+
+    def test_snippet_escaped(self):
+        """Текст поста в сниппете экранируется."""
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': 'собак'}
+        )
+        self.assertContains(response, '&lt;<mark>собак</mark>&gt;')
+
+    def test_keyset_pagination(self):
+        """Курсор продолжает выдачу без повторов."""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'кот номер {number}')
+            for number in range(POSTS_AMOUNT)
+        )
+        address = reverse('posts:search')
+        first = self.guest_client.get(address, {'q': 'кот'})
+        first_page = first.context['page_obj']
+        self.assertEqual(len(first_page), POSTS_AMOUNT)
+        second_page = self.guest_client.get(
+            address, {'q': 'кот', 'after': first_page.next_cursor}
+        ).context['page_obj']
+        self.assertIsNone(second_page.next_cursor)
+        seen = [post.pk for post in first_page]
+        seen += [post.pk for post in second_page]
+        self.assertEqual(len(seen), POSTS_AMOUNT + 2)
+        self.assertEqual(len(set(seen)), len(seen))
+
+    def test_query_operators_ignored(self):
+        """Синтаксис FTS5 в запросе не ломает поиск."""
+        for query in ('"кот', 'кот OR', 'NEAR(', '*', ''):
+            with self.subTest(query=query):
+                response = self.guest_client.get(
+                    reverse('posts:search'), {'q': query}
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт через полнотекстовый индекс."""
+        self.guest_client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'кот'}
+            )
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertTrue(any(
+            'MATCH' in query['sql'] for query in queries.captured_queries
+        ))
+
+
+class AutocompleteTest(TransactionTestCase):
+    """Тестирование подсказок авторов и групп."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='Leo')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='lions',
+            description='Тестовое описание'
+        )
+        User.objects.create(username='mark')
+        self.guest_client = Client()
+
+    def values(self, prefix):
+        return [(item['type'], item['value']) for item in suggest(prefix)]
+
+    def test_prefix_search(self):
+        """Подсказки ищутся по началу без учёта регистра."""
+        response = self.guest_client.get(
+            reverse('posts:autocomplete'), {'q': 'l'}
+        )
+        self.assertEqual(response.json()['results'], [
+            {
+                'type': 'user',
+                'value': 'Leo',
+                'url': reverse('posts:profile', args=('Leo',)),
+            },
+            {
+                'type': 'group',
+                'value': 'lions',
+                'url': reverse('posts:group_list', args=('lions',)),
+            },
+        ])
+        self.assertEqual(self.values('LI'), [('group', 'lions')])
+        self.assertEqual(self.values('x'), [])
+
+    def test_no_queries_per_keystroke(self):
+        """Прогретый индекс отвечает без запросов к базе."""
+        suggest('l')
+        with self.assertNumQueries(0):
+            for prefix in ('m', 'ma', 'mar'):
+                self.guest_client.get(
+                    reverse('posts:autocomplete'), {'q': prefix}
+                )
+
+    def test_incremental_updates(self):
+        """Изменения применяются к индексу без перестройки."""
+        suggest('l')
+        User.objects.create(username='lily')
+        self.group.slug = 'tigers'
+        self.group.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.values('l'), [('user', 'Leo'), ('user', 'lily')]
+            )
+            self.assertEqual(self.values('t'), [('group', 'tigers')])
+        self.user.delete()
+        self.assertEqual(self.values('l'), [('user', 'lily')])
+
+    def test_rolled_back_change_not_recorded(self):
+        """Откаченное создание не добавляет подсказку."""
+        suggest('l')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                User.objects.create(username='lily')
+                User.objects.create(username='lily')
+        self.assertEqual(
+            self.values('l'), [('user', 'Leo'), ('group', 'lions')]
+        )
+
+    def test_change_written_before_sequence(self):
+        """Номер изменения публикуется после записи изменения."""
+        suggest('l')
+        sequence = cache.get(SEQUENCE_KEY)
+        User.objects.create(username='lily')
+        self.assertEqual(cache.get(SEQUENCE_KEY), sequence + 1)
+        self.assertEqual(
+            cache.get(CHANGE_KEY.format(sequence + 1)), ('add', 'user', 'lily')
+        )
+
+    def test_rebuild_when_changes_evicted(self):
+        """Если изменения вытеснены из кэша, индекс строится заново."""
+        suggest('l')
+        User.objects.create(username='lily')
+        cache.delete(CHANGE_KEY.format(cache.get(SEQUENCE_KEY)))
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                self.values('li'), [('user', 'lily'), ('group', 'lions')]
+            )
+
+
+# Картинка 2x1 для тестов миниатюр
+SMALL_GIF: bytes = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+class ThumbnailMixin:
+    """Временная папка для медиа и пост с картинкой."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(
+            MEDIA_ROOT=self.media_root, THUMBNAIL_WORKERS=0
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        self.user = User.objects.create(username='testuser')
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='small.gif', content=SMALL_GIF, content_type='image/gif'
+            )
+        )
+
+    def ready(self, post):
+        return ready_thumbnail(
+            post.image, '960x339', crop='center', upscale=True
+        )
+
+
+class ThumbnailFallbackTest(ThumbnailMixin, TestCase):
+    """Тестирование страниц до готовности миниатюр."""
+
+    def test_original_until_ready(self):
+        """Без миниатюры страница показывает исходную картинку."""
+        post = self.create_post()
+        client = Client()
+        client.force_login(self.user)
+        address = reverse('posts:post_detail', args=(post.pk,))
+        self.assertIsNone(self.ready(post))
+        self.assertContains(client.get(address), post.image.url)
+        thumbnail = self.ready(post)
+        self.assertIsNotNone(thumbnail)
+        self.assertContains(client.get(address), thumbnail.url)
+
+
+class ThumbnailSchedulingTest(ThumbnailMixin, TransactionTestCase):
+    """Тестирование подготовки миниатюр при сохранении поста."""
+
+    def test_prepared_after_commit(self):
+        """Миниатюры готовятся после сохранения и сбрасывают кэш."""
+        before = get_generations('feed:index')
+        post = self.create_post()
+        self.assertIsNotNone(self.ready(post))
+        self.assertNotEqual(get_generations('feed:index'), before)
+
+    def test_not_prepared_without_new_image(self):
+        """Правка текста не ставит миниатюры в очередь заново."""
+        post = self.create_post()
+        post.text = 'Новый текст'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertFalse(any(
+            'thumbnail_kvstore' in query['sql']
+            for query in queries.captured_queries
+        ))
+
+    def largest(self, post):
+        return post.thumbnails.get(width=960, format='JPEG')
+
+    def test_thumbnails_stored_with_post(self):
+        """Все варианты картинки записываются к посту с размерами."""
+        post = self.create_post()
+        self.assertEqual(
+            set(post.thumbnails.values_list('width', 'height', 'format')),
+            {
+                (width, width * 339 // 960, format_)
+                for width in settings.THUMBNAIL_WIDTHS
+                for format_ in settings.THUMBNAIL_FORMATS
+            }
+        )
+        self.assertEqual(self.largest(post).name, self.ready(post).name)
+        self.assertTrue(
+            post.thumbnails.get(width=320, format='WEBP').name.endswith(
+                '.webp'
+            )
+        )
+
+    def test_feed_resolves_thumbnails_in_one_query(self):
+        """Лента берёт миниатюры одним запросом без хранилища sorl."""
+        posts = [self.create_post() for _ in range(3)]
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(reverse('posts:index'))
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(
+            len([query for query in sql if 'posts_postthumbnail' in query]),
+            1
+        )
+        self.assertFalse(any('thumbnail_kvstore' in query for query in sql))
+        for post in posts:
+            self.assertContains(response, self.largest(post).url)
+
+    def test_feed_srcset(self):
+        """Карточка ленты отдаёт srcset по форматам и размеры."""
+        post = self.create_post()
+        cache.clear()
+        response = Client().get(reverse('posts:index'))
+        webp = post.thumbnails.filter(format='WEBP').order_by('width')
+        self.assertContains(
+            response,
+            'srcset="{}"'.format(', '.join(
+                f'{thumbnail.url} {thumbnail.width}w' for thumbnail in webp
+            ))
+        )
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_new_image_replaces_thumbnails(self):
+        """Замена картинки заменяет записанные миниатюры."""
+        post = self.create_post()
+        old = self.largest(post).name
+        other = io.BytesIO()
+        Image.new('RGB', (4, 2), 'blue').save(other, 'GIF')
+        post.image = SimpleUploadedFile(
+            name='other.gif',
+            content=other.getvalue(),
+            content_type='image/gif'
+        )
+        post.save()
+        self.assertNotEqual(self.largest(post).name, old)
+        post.image = ''
+        post.save()
+        self.assertFalse(PostThumbnail.objects.filter(post=post).exists())
+
+
+class ImageStorageTest(ThumbnailMixin, TransactionTestCase):
+    """Тестирование общих файлов одинаковых картинок."""
+
+    def test_same_image_stored_once(self):
+        """Одинаковые картинки — один файл, пока на него ссылаются."""
+        first, second = self.create_post(), self.create_post()
+        self.assertEqual(first.image.name, second.image.name)
+        storage = first.image.storage
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+
+    def test_same_image_uploaded_again(self):
+        """Повторная загрузка той же картинки не оставляет лишней ссылки."""
+        post = self.create_post()
+        name = post.image.name
+        post.image = SimpleUploadedFile(
+            name='small.gif', content=SMALL_GIF, content_type='image/gif'
+        )
+        post.save()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+        post.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(post.image.storage.exists(name))
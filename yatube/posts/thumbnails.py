@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from sorl.thumbnail.conf import settings as thumbnail_settings
+
+from core.thumbnails import ready_thumbnail
+
+from .models import Post, PostThumbnail
+
+
+def with_thumbnails(queryset):
+    """
+    Посты с вариантами картинки для ленты в post.feed_thumbnails
+    (от узких к широким): один запрос на страницу вместо
+    запроса на каждый пост.
+    """
+    geometries = {geometry for geometry, _ in settings.THUMBNAIL_PRESETS}
+    return queryset.prefetch_related(
+        Prefetch(
+            'thumbnails',
+            queryset=PostThumbnail.objects.filter(
+                geometry__in=geometries
+            ).order_by('width'),
+            to_attr='feed_thumbnails'
+        )
+    )
+
+
+def store_thumbnails(post_id, name):
+    """
+    Записывает готовые миниатюры THUMBNAIL_PRESETS к посту.
+    Если картинку поста успели заменить, ничего не делает.
+    """
+    post = Post.objects.filter(pk=post_id, image=name).first()
+    if post is None:
+        return
+    thumbnails = []
+    for geometry, options in settings.THUMBNAIL_PRESETS:
+        thumbnail = ready_thumbnail(post.image, geometry, **options)
+        if thumbnail is None:
+            continue
+        thumbnails.append(PostThumbnail(
+            post=post,
+            geometry=geometry,
+            format=options.get('format', thumbnail_settings.THUMBNAIL_FORMAT),
+            name=thumbnail.name,
+            width=thumbnail.width,
+            height=thumbnail.height
+        ))
+    with transaction.atomic():
+        PostThumbnail.objects.filter(post=post).delete()
+        PostThumbnail.objects.bulk_create(thumbnails)
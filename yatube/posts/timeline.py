@@ -0,0 +1,241 @@
+import heapq
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import FeedEntry, Follow, Post, UserStats
+
+logger = logging.getLogger(__name__)
+
+# Шаблон ключа кэша со списком последних постов автора
+RECENT_CACHE_KEY: str = 'posts:recent:{}'
+
+# Сколько записей лент вставлять одним запросом при рассылке
+FANOUT_BATCH_SIZE: int = 1000
+
+
+def timeline_length():
+    """Сколько записей хранить в ленте одного пользователя."""
+    return settings.POSTS_TIMELINE_LENGTH
+
+
+def followers_count(author_id):
+    """Число подписчиков автора по счётчику."""
+    return UserStats.objects.filter(
+        user_id=author_id
+    ).values_list('followers_count', flat=True).first() or 0
+
+
+def is_pulled(author_id):
+    """
+    Авторы, у которых подписчиков не меньше порога, не
+    рассылаются по лентам: их посты подмешиваются при чтении.
+    """
+    return followers_count(author_id) >= settings.POSTS_FANOUT_FOLLOWERS_LIMIT
+
+
+def left_pulled(author_id):
+    """
+    Автор только что опустился ниже порога: его посты больше
+    не подмешиваются при чтении, а написанные выше порога
+    в ленты не разосланы.
+    """
+    return (
+        followers_count(author_id)
+        == settings.POSTS_FANOUT_FOLLOWERS_LIMIT - 1
+    )
+
+
+def pulled_authors(user):
+    """id авторов из подписок пользователя, читаемых при чтении ленты."""
+    return list(
+        Follow.objects.filter(
+            user=user,
+            author__stats__followers_count__gte=(
+                settings.POSTS_FANOUT_FOLLOWERS_LIMIT
+            )
+        ).values_list('author_id', flat=True)
+    )
+
+
+def recent_posts(author_ids):
+    """
+    Последние посты авторов в виде списков (pub_date, id)
+    от новых к старым. Списки хранятся в кэше.
+    """
+    keys = {RECENT_CACHE_KEY.format(pk): pk for pk in author_ids}
+    lists = cache.get_many(keys)
+    for key, author_id in keys.items():
+        if key in lists:
+            continue
+        lists[key] = list(
+            Post.objects.filter(
+                author_id=author_id
+            ).order_by('-pub_date', '-pk').values_list(
+                'pub_date', 'pk'
+            )[:timeline_length()]
+        )
+        cache.set(
+            key, lists[key], settings.POSTS_RECENT_POSTS_TIMEOUT
+        )
+    return list(lists.values())
+
+
+def forget_recent_posts(author_id):
+    """Сбрасывает кэш последних постов автора."""
+    cache.delete(RECENT_CACHE_KEY.format(author_id))
+
+
+def trim(user_ids):
+    """
+    Обрезает ленты до timeline_length(). Лента обрезается
+    только когда переполнена на POSTS_TIMELINE_SLACK записей,
+    чтобы не удалять по одной записи на каждый новый пост.
+    """
+    length = timeline_length()
+    overflowed = FeedEntry.objects.filter(
+        user_id__in=user_ids
+    ).order_by().values('user_id').annotate(
+        amount=Count('id')
+    ).filter(
+        amount__gt=length + settings.POSTS_TIMELINE_SLACK
+    ).values_list('user_id', flat=True)
+    for user_id in overflowed:
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        last = entries.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id'
+        )[length - 1]
+        entries.filter(pub_date__lte=last[0]).exclude(
+            pub_date=last[0], id__gte=last[1]
+        ).delete()
+
+
+def fan_out(post, pulled=None):
+    """
+    Рассылает новый пост в ленты подписчиков автора.
+    pulled — уже известный результат is_pulled() для автора.
+    """
+    if pulled is None:
+        pulled = is_pulled(post.author_id)
+    if pulled:
+        return
+    followers = list(
+        Follow.objects.filter(
+            author_id=post.author_id
+        ).values_list('user_id', flat=True)
+    )
+    FeedEntry.objects.bulk_create(
+        FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers
+    )
+    trim(followers)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты нового автора."""
+    if is_pulled(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).exclude(
+        feed_entries__user_id=user_id
+    ).order_by('-pub_date').values_list('pk', 'pub_date')
+    FeedEntry.objects.bulk_create(
+        FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts[:timeline_length()]
+    )
+    trim([user_id])
+
+
+def push_author(author_id):
+    """
+    Рассылает последние посты автора по лентам всех его
+    подписчиков. Возвращает id подписчиков.
+    """
+    posts = list(
+        Post.objects.filter(
+            author_id=author_id
+        ).order_by('-pub_date', '-pk').values_list(
+            'pk', 'pub_date'
+        )[:timeline_length()]
+    )
+    followers = list(
+        Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True)
+    )
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for user_id in followers
+            for pk, pub_date in posts
+        ),
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    trim(followers)
+    return followers
+
+
+def remove_author(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    FeedEntry.objects.filter(
+        user_id=user_id,
+        post__author_id=author_id
+    ).delete()
+
+
+def merge_timeline(user, author_ids):
+    """
+    Сливает разосланную ленту пользователя со списками
+    последних постов авторов (k-way слияние по pub_date).
+    Возвращает id постов от новых к старым.
+    """
+    started = time.perf_counter()
+    length = timeline_length()
+    sources = recent_posts(author_ids)
+    sources.append(
+        FeedEntry.objects.filter(
+            user=user
+        ).order_by('-pub_date', '-post_id').values_list(
+            'pub_date', 'post_id'
+        )[:length]
+    )
+    post_ids = []
+    seen = set()
+    for _, post_id in heapq.merge(*sources, reverse=True):
+        if post_id in seen:
+            continue
+        seen.add(post_id)
+        post_ids.append(post_id)
+        if len(post_ids) == length:
+            break
+    logger.debug(
+        'Timeline merge for user %s: %d sources, %d posts, %.2f ms',
+        user.pk,
+        len(sources),
+        len(post_ids),
+        (time.perf_counter() - started) * 1000
+    )
+    return post_ids
+
+
+def timeline_posts(user, pulled=None):
+    """
+    Посты ленты подписок пользователя, от новых к старым.
+    pulled — авторы, чьи посты подмешиваются при чтении.
+    """
+    if not pulled:
+        return Post.objects.filter(
+            feed_entries__user=user
+        ).select_related(
+            'author', 'group'
+        ).order_by('-feed_entries__pub_date', '-pk')
+    return Post.objects.filter(
+        pk__in=merge_timeline(user, pulled)
+    ).select_related(
+        'author', 'group'
+    ).order_by('-pub_date', '-pk')
@@ -1,11 +1,300 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Max, Min, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 
-def page_paginator(request, post_list, posts_amount):
-    """Пагинатор на страницы."""
-    paginator = Paginator(
+# Поля, по которым сортируются записи в курсорном режиме.
+# Второе поле разрешает совпадения первого, поэтому порядок
+# остаётся стабильным, даже если новые посты появились во
+# время прокрутки ленты.
+CURSOR_FIELDS: tuple = ('pub_date', 'pk')
+
+# Поля курсора для комментариев
+COMMENT_CURSOR_FIELDS: tuple = ('created', 'pk')
+
+# Заполнитель пропущенных страниц в навигации
+ELLIPSIS: str = '…'
+
+# Параметры запроса, задающие страницу ленты
+PAGE_PARAMS: tuple = ('page', 'after', 'before')
+
+# Шаблон ключа кэша для количества постов в ленте
+COUNT_CACHE_KEY: str = 'posts:count:{}'
+
+
+def count_cache_key(scope):
+    """Ключ кэша для счётчика ленты (index, group:1, author:1...)."""
+    return COUNT_CACHE_KEY.format(scope)
+
+
+def invalidate_counts(*scopes):
+    """Сбрасывает закэшированные счётчики лент."""
+    cache.delete_many([count_cache_key(scope) for scope in scopes])
+
+
+def estimate_count(queryset, limit=None):
+    """
+    Считает записи не дальше limit строк. Если записей больше,
+    возвращает оценку по диапазону первичных ключей вместо
+    полного COUNT(*). Оценка годится только для таблицы целиком:
+    id записей автора или группы перемежаются с чужими, поэтому
+    отфильтрованные ленты считаются точно.
+    """
+    if limit is None:
+        limit = settings.POSTS_COUNT_EXACT_LIMIT
+    queryset = queryset.order_by()
+    if queryset.query.has_filters():
+        return queryset.count()
+    exact = queryset[:limit + 1].count()
+    if exact <= limit:
+        return exact
+    span = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    return max(limit + 1, span['high'] - span['low'] + 1)
+
+
+def cached_count(queryset, scope=None):
+    """
+    Количество записей ленты из кэша. Без scope
+    считает через estimate_count без кэширования.
+    """
+    if scope is None:
+        return estimate_count(queryset)
+    key = count_cache_key(scope)
+    count = cache.get(key)
+    if count is None:
+        count = estimate_count(queryset)
+        cache.set(key, count, settings.POSTS_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, берущий количество записей из cached_count."""
+
+    ELLIPSIS = ELLIPSIS
+
+    def __init__(self, object_list, per_page, count_scope=None,
+                 known_count=None):
+        super().__init__(object_list, per_page)
+        self.count_scope = count_scope
+        self.known_count = known_count
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        return cached_count(self.object_list, self.count_scope)
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """
+        Номера страниц вокруг текущей и по краям, пропуски
+        заменены на ELLIPSIS. Полный page_range не строится.
+        """
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2 + 1:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield ELLIPSIS
+            start = number - on_each_side
+        else:
+            start = 1
+        if number < num_pages - on_each_side - on_ends - 1:
+            yield from range(start, number + on_each_side + 1)
+            yield ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(start, num_pages + 1)
+
+
+def encode_cursor(obj, fields=CURSOR_FIELDS):
+    """Упаковывает ключ записи в непрозрачный токен."""
+    values = []
+    for field in fields:
+        value = getattr(obj, field)
+        values.append(
+            value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        )
+    raw = '|'.join(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Распаковывает токен в пару (дата, id).
+    Для повреждённого токена возвращает None.
+    """
+    if not token:
+        return None
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(token + padding).decode()
+        value, pk = raw.split('|')
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if value is None:
+        return None
+    return value, pk
+
+
+class CursorPage(Page):
+    """Страница курсорного пагинатора."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return encode_cursor(
+            self.object_list[-1], self.paginator.fields
+        )
+
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(
+            self.object_list[0], self.paginator.fields
+        )
+
+
+class CursorPaginator(Paginator):
+    """
+    Пагинатор по ключу (pub_date, id) без OFFSET и COUNT(*).
+    Записи выводятся от новых к старым, с descending=False —
+    от старых к новым.
+    """
+
+    def __init__(self, object_list, per_page, fields=CURSOR_FIELDS,
+                 descending=True):
+        super().__init__(object_list.order_by(*fields), per_page)
+        self.fields = fields
+        self.descending = descending
+
+    def _fetch(self, key, forward):
+        """
+        До per_page + 1 записей за ключом key в порядке страниц
+        или, с forward=False, в обратном. Без ключа — с края.
+        """
+        descending = forward == self.descending
+        queryset = self.object_list.order_by(
+            *(('-' if descending else '') + field for field in self.fields)
+        )
+        if key is not None:
+            field, tie = self.fields
+            value, pk = key
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value})
+                | Q(**{field: value, f'{tie}__{lookup}': pk})
+            )
+        return list(queryset[:self.per_page + 1])
+
+    def first_page(self):
+        items = self._fetch(None, forward=True)
+        return CursorPage(
+            items[:self.per_page], self, len(items) > self.per_page, False
+        )
+
+    def last_page(self):
+        items = self._fetch(None, forward=False)
+        return CursorPage(
+            items[:self.per_page][::-1], self,
+            False, len(items) > self.per_page
+        )
+
+    def get_cursor_page(self, after=None, before=None):
+        """
+        Возвращает страницу после токена after или перед
+        токеном before. Без токенов — первую страницу. Если
+        за токеном записей нет (устаревший токен или записи
+        удалены), возвращает крайнюю страницу, как get_page()
+        для номера за пределами ленты.
+        """
+        after_key = decode_cursor(after)
+        before_key = decode_cursor(before)
+        if before_key is not None:
+            items = self._fetch(before_key, forward=False)
+            if not items:
+                return self.first_page()
+            return CursorPage(
+                items[:self.per_page][::-1], self,
+                True, len(items) > self.per_page
+            )
+        if after_key is None:
+            return self.first_page()
+        items = self._fetch(after_key, forward=True)
+        if not items:
+            return self.last_page()
+        return CursorPage(
+            items[:self.per_page], self, len(items) > self.per_page, True
+        )
+
+
+def page_paginator(request, post_list, posts_amount, cursor=False,
+                   count_scope=None, known_count=None,
+                   cursor_fields=CURSOR_FIELDS, descending=True):
+    """
+    Пагинатор на страницы.
+    С cursor=True переключается на курсорный режим
+    с параметрами ?after=/?before=, descending задаёт
+    порядок записей. count_scope задаёт ключ кэша для
+    количества записей, known_count — готовое значение
+    из счётчика.
+    """
+    if cursor:
+        paginator = CursorPaginator(
+            post_list,
+            posts_amount,
+            fields=cursor_fields,
+            descending=descending
+        )
+        return paginator.get_cursor_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before')
+        )
+    paginator = CachedCountPaginator(
         post_list,
-        posts_amount
+        posts_amount,
+        count_scope=count_scope,
+        known_count=known_count
     )
     page_number = request.GET.get('page')
     return paginator.get_page(page_number)
+
+
+def feed_cache(request, tag):
+    """
+    Параметры фрагментного кэша ленты для шаблона: ключ
+    зависит от тега ленты и страницы, фрагмент устаревает
+    со сдвигом поколения тега.
+    """
+    page = '|'.join(request.GET.get(param, '') for param in PAGE_PARAMS)
+    return {
+        'feed_cache_timeout': settings.POSTS_FEED_CACHE_TIMEOUT,
+        'feed_cache_key': f'{tag}:{page}',
+        'feed_cache_tags': [tag],
+    }
@@ -1,10 +1,24 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import etag
 
+from core.cache import cache_tags, tag_request
+
+from .autocomplete import suggest
+from .comments import COMMENTS_AMOUNT, comment_page
+from .conditional import (etag_func, group_state, index_state, post_state,
+                          post_tags, profile_state)
+from .counters import user_stats
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post
-from .utils import page_paginator
+from .models import Follow, Group, Post
+from .search import search_posts
+from .thumbnails import with_thumbnails
+from .timeline import pulled_authors, timeline_posts
+from .utils import COMMENT_CURSOR_FIELDS, feed_cache, page_paginator
 
 User = get_user_model()
 
@@ -12,78 +26,108 @@ User = get_user_model()
 POSTS_AMOUNT: int = 10
 
 
+@etag(etag_func(index_state))
+@cache_tags('feed:index')
 def index(request):
     """Главная страница."""
     template = 'posts/index.html'
-    post_list = Post.objects.prefetch_related(
+    post_list = with_thumbnails(Post.objects.prefetch_related(
         'author'
     ).prefetch_related(
         'group'
-    ).all()
+    ).all())
     page_obj = page_paginator(
         request,
         post_list,
-        POSTS_AMOUNT
+        POSTS_AMOUNT,
+        cursor=settings.POSTS_CURSOR_PAGINATION,
+        count_scope='index'
     )
     context = {
         'page_obj': page_obj,
+        **feed_cache(request, 'feed:index'),
     }
     return render(request, template, context)
 
 
+@etag(etag_func(group_state))
 def group_posts(request, slug):
     """Страница с постами по группам."""
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.prefetch_related(
+    tag_request(request, f'group:{group.pk}')
+    post_list = with_thumbnails(group.posts.prefetch_related(
         'author'
-    ).all()
+    ).all())
     page_obj = page_paginator(
         request,
         post_list,
-        POSTS_AMOUNT
+        POSTS_AMOUNT,
+        cursor=settings.POSTS_CURSOR_PAGINATION,
+        count_scope=f'group:{group.pk}'
     )
     context = {
         'group': group,
         'page_obj': page_obj,
+        **feed_cache(request, f'group:{group.pk}'),
     }
     return render(request, template, context)
 
 
+@etag(etag_func(profile_state))
 def profile(request, username):
     """Профайл пользователя."""
     template = 'posts/profile.html'
     author = get_object_or_404(User, username=username)
+    tag_request(request, f'author:{author.pk}')
     if request.user.is_authenticated:
         following = request.user.follower.filter(
             author=author
         ).exists()
     else:
         following = False
-    post_list = author.posts.prefetch_related(
+    post_list = with_thumbnails(author.posts.prefetch_related(
         'group'
-    ).all()
-    count = post_list.count()
+    ).all())
+    stats = user_stats(author)
     page_obj = page_paginator(
         request,
         post_list,
-        POSTS_AMOUNT
+        POSTS_AMOUNT,
+        cursor=settings.POSTS_CURSOR_PAGINATION,
+        known_count=stats.posts_count
     )
     context = {
-        'count': count,
+        'count': stats.posts_count,
+        'stats': stats,
         'author': author,
         'page_obj': page_obj,
         'following': following,
+        **feed_cache(request, f'author:{author.pk}'),
     }
     return render(request, template, context)
 
 
+@etag(etag_func(post_state))
 def post_detail(request, post_id):
     """Страница просмотра записи."""
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id
+    )
+    tag_request(request, *post_tags(post.pk, post.author_id, post.group_id))
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
+    # Комментарии листаются курсором от старых к новым: число
+    # запросов не зависит от количества комментариев под постом
+    comments = page_paginator(
+        request,
+        post.comments.select_related('author'),
+        COMMENTS_AMOUNT,
+        cursor=True,
+        cursor_fields=COMMENT_CURSOR_FIELDS,
+        descending=False
+    )
     context = {
         'post': post,
         'form': form,
@@ -92,6 +136,42 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+@cache_tags('post:{post_id}')
+def post_comments(request, post_id):
+    """
+    Следующая порция комментариев для подгрузки на странице
+    поста: HTML-фрагмент или JSON с ?format=json.
+    """
+    page = comment_page(post_id, request.GET.get('after'))
+    if page is None:
+        raise Http404
+    if request.GET.get('format') == 'json':
+        return JsonResponse(page)
+    context = {
+        **page,
+        'post_id': post_id,
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
+def search(request):
+    """Поиск по текстам постов."""
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    page_obj = search_posts(query, request.GET.get('after'), POSTS_AMOUNT)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, template, context)
+
+
+def autocomplete(request):
+    """Подсказки авторов и групп по началу имени или адреса."""
+    prefix = request.GET.get('q', '').strip()
+    return JsonResponse({'results': suggest(prefix) if prefix else []})
+
+
 @login_required
 def post_create(request):
     """Страница для публикации постов."""
@@ -104,7 +184,8 @@ def post_create(request):
         )
         if form.is_valid():
             form.instance.author = request.user
-            form.save()
+            with transaction.atomic():
+                form.save()
             return redirect('posts:profile', request.user)
         return render(request, template, {'form': form})
     form = PostForm()
@@ -158,7 +239,8 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id)
 
 
@@ -166,13 +248,14 @@ def add_comment(request, post_id):
 def follow_index(request):
     """Страница с подписками пользователя."""
     template = 'posts/follow.html'
-    post_list = Post.objects.filter(
-        author__following__user=request.user
-    )
+    pulled = pulled_authors(request.user)
+    post_list = with_thumbnails(timeline_posts(request.user, pulled))
     page_obj = page_paginator(
         request,
         post_list,
-        POSTS_AMOUNT
+        POSTS_AMOUNT,
+        cursor=settings.POSTS_CURSOR_PAGINATION,
+        count_scope=None if pulled else f'follow:{request.user.pk}'
     )
     context = {'page_obj': page_obj}
     return render(request, template, context)
@@ -183,10 +266,11 @@ def profile_follow(request, username):
     """Подписаться."""
     author = get_object_or_404(User, username=username)
     if author != request.user:
-        Follow.objects.get_or_create(
-            user=request.user,
-            author=author
-        )
+        with transaction.atomic():
+            Follow.objects.get_or_create(
+                user=request.user,
+                author=author
+            )
     return redirect('posts:profile', username)
 
 
@@ -196,5 +280,6 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     data = request.user.follower.filter(author=author)
     if data.exists():
-        data.delete()
+        with transaction.atomic():
+            data.delete()
     return redirect('posts:profile', username)
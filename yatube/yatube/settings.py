@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'core.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
@@ -144,12 +145,112 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Ширины миниатюр картинок постов для srcset; высота
+# держит пропорции карточки 960x339
+THUMBNAIL_WIDTHS = (320, 640, 960)
+
+# Форматы каждой ширины: WebP и JPEG для остальных браузеров
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+
+# Миниатюры картинок постов (размер, опции sorl). Готовятся
+# в фоне сразу после загрузки; шаблоны запрашивают те же
+THUMBNAIL_PRESETS = tuple(
+    (
+        f'{width}x{width * 339 // 960}',
+        {'crop': 'center', 'upscale': True, 'format': format_},
+    )
+    for width in THUMBNAIL_WIDTHS
+    for format_ in THUMBNAIL_FORMATS
+)
+
+# Сколько потоков готовят миниатюры; 0 — готовить сразу
+THUMBNAIL_WORKERS = 2
+
+# Загрузки всегда пишутся во временный файл по частям,
+# а не собираются в памяти
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Предельный размер загружаемой картинки, байт
+IMAGE_MAX_SIZE = 20 * 1024 * 1024
+
+# Предельное число пикселей; проверяется по заголовку файла
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+# Картинки больше по любой стороне уменьшаются при загрузке
+IMAGE_MAX_DIMENSION = 2560
+
+# Качество JPEG при перекодировании загруженных картинок
+IMAGE_QUALITY = 85
+
+# Сколько процессов перекодируют загрузки; 0 — в потоке запроса
+IMAGE_WORKERS = 2
+
+# Сколько секунд запрос ждёт перекодирования картинки
+IMAGE_TIMEOUT = 30
+
+# L1 в памяти процесса перед общим для всех worker-ов
+# кэшем 'shared' в файле SQLite (режим WAL)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.tiered_cache.TwoTierCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'L2': 'shared',
+            'MAX_MEMORY': 16 * 1024 * 1024,
+            'CHECK_INTERVAL': 500,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.sqlite_cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    },
 }
 
+# manage.py test запускает тесты с настройками из
+# yatube/settings_test.py
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Сколько секунд хранить закэшированные фрагменты лент.
+# Фрагменты сбрасываются сигналами при изменении постов
+POSTS_FEED_CACHE_TIMEOUT = 60 * 5
+
+# Сколько секунд хранить порции комментариев. Порции
+# сбрасываются сигналами при изменении комментариев
+POSTS_COMMENTS_CACHE_TIMEOUT = 60 * 5
+
+# Курсорная пагинация лент (?after=/?before=) вместо
+# постраничной (?page=)
+POSTS_CURSOR_PAGINATION = False
+
+# Сколько секунд хранить в кэше количество постов ленты
+POSTS_COUNT_CACHE_TIMEOUT = 60 * 15
+
+# До скольких постов лента считается точно; для больших
+# лент количество оценивается по диапазону id
+POSTS_COUNT_EXACT_LIMIT = 10000
+
+# Сколько постов хранится в ленте подписок одного пользователя
+POSTS_TIMELINE_LENGTH = 500
+
+# На сколько записей лента может превысить длину до обрезки
+POSTS_TIMELINE_SLACK = 50
+
+# Начиная с этого числа подписчиков посты автора не рассылаются
+# по лентам, а подмешиваются в ленту при чтении
+POSTS_FANOUT_FOLLOWERS_LIMIT = 10000
+
+# Сколько секунд хранить в кэше списки последних постов авторов
+POSTS_RECENT_POSTS_TIMEOUT = 60 * 15
+
+# Сколько секунд хранить страницы для анонимных читателей.
+# Страницы сбрасываются сигналами при изменении постов
+PAGE_CACHE_TIMEOUT = 60 * 10
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 INTERNAL_IPS = [
@@ -0,0 +1,27 @@
+"""
+Настройки тестов. pytest берёт модуль из pytest.ini,
+manage.py test применяет OVERRIDES через TEST_RUNNER.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES as BASE_CACHES
+
+# Общий уровень кэша в памяти процесса: тесты не очищают
+# файл кэша разработчика и не переносят состояние между запусками
+CACHES = {
+    **BASE_CACHES,
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
+# Миниатюры готовятся сразу: фоновый поток писал бы
+# в MEDIA_ROOT, который тест уже удаляет
+THUMBNAIL_WORKERS = 0
+
+# Настройки, которыми тесты отличаются от обычных
+OVERRIDES: dict = {
+    'CACHES': CACHES,
+    'THUMBNAIL_WORKERS': THUMBNAIL_WORKERS,
+}